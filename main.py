@@ -12,20 +12,22 @@ tar.miscellaneous.print_header()
 args   = tar.inputs.args
 ckp    = tar.miscellaneous._Checkpoint_(args)
 loader = tar.dataloader._Data_(args)
-loss   = tar.optimization._Loss_(args, ckp) if not args.valid_only else None
-model  = tar.modules._Model_(args, ckp)
-if args.type == "SCALING" and args.format == "IMAGE":
-   trainer = tar.trainers.iscale._Trainer_IScale_(args,loader,model,loss,ckp)
-elif args.type == "COLORING" and args.format == "IMAGE":
-    trainer = tar.trainers.icolor._Trainer_IColor_(args,loader,model,loss,ckp)
-elif args.type == "SCALING" and args.format == "VIDEO":
-   trainer = tar.trainers.vexternal._Trainer_VExternal_(args,loader,model,loss,ckp)
-else:
-   raise ValueError("Invalid trainer selection {}".format(args.type))
-
-device = torch.device('cpu' if args.cpu else args.cuda_device)
-ckp.write_log("Machine: {}".format(torch.cuda.get_device_name(None)))
-while trainer.step():
-    trainer.train()
-    trainer.validation()
-ckp.done()
+# The worker pools are shut down and the checkpoint is finalized also when
+# exiting after a training snapshot (sys.exit(99)).
+try:
+    if len(args.valid_epochs) > 0:
+        # Post-hoc evaluation of saved epochs, the worker processes build
+        # their models (cuda is not initialized before forking them).
+        tar.evaluation.evaluate_epochs(args, loader, ckp)
+    else:
+        loss    = tar.optimization._Loss_(args, ckp) if not args.valid_only else None
+        model   = tar.modules._Model_(args, ckp)
+        trainer = tar.trainers.build_trainer(args, loader, model, loss, ckp)
+        device  = torch.device('cpu' if args.cpu else args.cuda_device)
+        ckp.write_log("Machine: {}".format(torch.cuda.get_device_name(None)))
+        while trainer.step():
+            trainer.train()
+            trainer.validation()
+finally:
+    loader.shutdown()
+    ckp.done()
@@ -12,6 +12,11 @@
 ## stderr and stdout are merged together to stdout
 #$ -j y
 #
+## send SIGUSR2 before the job is killed, training then saves a snapshot and
+## exits with code 99 to be rescheduled, pass --continue_from <name> to
+## continue from the snapshot in outs/<name>
+#$ -notify
+#
 # logging directory. preferrably on your scratch
 #$ -o /scratch_net/biwidl215/sischaef/outs/
 #
@@ -1,7 +1,6 @@
 # from __future__ import division
-import torch
 import torch.utils.data as data
-from skimage.color import rgb2lab, lab2rgb
+from skimage.color import lab2rgb
 from skimage.transform import resize, rescale
 
 import os, math, random
@@ -15,6 +14,8 @@ from utils.img_transforms import *
 # import natsort
 from torchvision.transforms import RandomRotation, Resize, Compose
 
+import tar.color as color
+
 class StaticRandomCrop(object):
     def __init__(self, image_size, crop_size):
         self.th, self.tw = crop_size
@@ -67,10 +68,8 @@ class Image_from_folder(data.Dataset):
         img = frame_utils.read_gen(self.gt_images[index])
         if self.train: img = resize(img ,(224, 224))
         else: img = resize(img, self.render_size)
-        img = rgb2lab(img)
-        img = np.array(img).transpose(2,0,1)
-        img = torch.from_numpy(img.astype(np.float32))
-        return img
+        img = color.rgb2lab(color.from_numpy(img.astype(np.float32)))
+        return img[0]
 
     def __len__(self):
         return self.size * self.replicates
@@ -3,7 +3,8 @@
 # =============================================================================
 # Created By  : Simon Schaefer
 # Description : Check downsamples dataset by comparing the LR shape with the
-#               HR shape given the scale factor.
+#               HR shape given the scale factor. Shapes are read from the
+#               dataset manifests, so only images to be cropped are decoded.
 # Arguments   : Path to HR images directory.
 #               Path to LR images directories (format X2).
 # =============================================================================
@@ -13,6 +14,7 @@ import numpy as np
 import os
 import sys
 
+from tar.dataloader import _Manifest_
 from utils import progress_bar
 
 # Get directory of images from input arguments.
@@ -32,26 +34,30 @@ max_scale = max(scales)
 print("... found scales {}".format(scales))
 
 # Iterate over all files in directory and check scale coherence.
-image_files = glob.glob(hr_directory + "*.png")
+manifest_hr = _Manifest_.open(hr_directory)
+manifests_lr = {s: _Manifest_.open(lr_directory + "X{}/".format(s)) for s in scales}
+image_files = manifest_hr.paths()
 num_files   = len(image_files)
 error_files = []
 error = ""
 for i, hr_filepath in enumerate(image_files):
-    hr = imageio.imread(hr_filepath)
     filename, _ = os.path.splitext(os.path.basename(hr_filepath))
-    if hr.shape[0] % max_scale != 0 or hr.shape[1] % max_scale != 0:
+    hr_shape = manifest_hr.shape(os.path.basename(hr_filepath))
+    if hr_shape[0] % max_scale != 0 or hr_shape[1] % max_scale != 0:
+        hr = imageio.imread(hr_filepath)
         os.remove(hr_filepath)
         if hr.shape[0] % max_scale != 0:
             hr = hr[:max_scale*(hr.shape[0]//max_scale),:,:]
         if hr.shape[1] % max_scale != 0:
             hr = hr[:,:max_scale*(hr.shape[1]//max_scale),:]
         imageio.imwrite(hr_filepath, hr.astype(np.uint8))
+        hr_shape = hr.shape
     for s in scales:
-        lr_filepath = lr_directory + "X{}/{}x{}.png".format(s,filename,s)
-        lr = imageio.imread(lr_filepath)
-        if not ((hr.shape[0] == s*lr.shape[0]) and (hr.shape[1] == s*lr.shape[1])):
+        lr_shape = manifests_lr[s].shape("{}x{}.png".format(filename,s))
+        if lr_shape is None or not ((hr_shape[0] == s*lr_shape[0]) \
+        and (hr_shape[1] == s*lr_shape[1])):
             if filename not in error_files:
-                error += "{},{},{},{}\n".format(filename,hr.shape,lr.shape,s)
+                error += "{},{},{},{}\n".format(filename,hr_shape,lr_shape,s)
                 error_files.append(filename)
     progress_bar(i+1, num_files)
 print("... finished checking, with error messages: \n{}".format(error))
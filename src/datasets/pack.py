@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Pack HR images and their downsampled LR images (all scales)
+#               into uint8 memory-mapped shards, which can be read by the
+#               tar dataloader without decoding (--packed flag).
+# Arguments   : Path to HR images directory.
+#               Path to LR images directories (format X2).
+# =============================================================================
+import glob
+import os
+import sys
+
+from tar.dataloader import _PackedDataset_
+from utils import progress_bar
+
+# Get directory of images from input arguments.
+if not len(sys.argv) >= 3:
+    raise ValueError("Please state [HR_directory, LR_directory] !")
+hr_directory = sys.argv[1]
+lr_directory = sys.argv[2]
+assert os.path.isdir(hr_directory)
+assert os.path.isdir(lr_directory)
+
+# Pack HR directory and every scale directory (assuming name "Xs").
+directories = [hr_directory] + sorted(glob.glob(os.path.join(lr_directory, "X*/")))
+print("Starting packing operation ...")
+for directory in directories:
+    print("... packing {}".format(directory))
+    n = _PackedDataset_.pack(directory, callback=progress_bar)
+    path = _PackedDataset_.shard_path(directory)
+    print("... packed {} images to {}.bin".format(n, path))
+print("... finished packing !")
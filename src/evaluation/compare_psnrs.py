@@ -42,6 +42,13 @@ assert all([os.path.isdir(x) for x in outs])
 # Read and parse logging files to get loss curves.
 configs = [parse_config(os.path.join(x, "config.txt")) for x in outs]
 logs    = [torch.load(os.path.join(x, "psnr_log.pt")) for x in outs]
+# Epochs of the logs evaluated post-hoc (see tar/evaluation.py), otherwise
+# one log per epoch.
+epochs = []
+for x, log in zip(outs, logs):
+    path = os.path.join(x, "psnr_epochs.pt")
+    xs = torch.load(path).numpy() if os.path.isfile(path) else []
+    epochs.append(xs if len(xs) == log.size()[0] else np.arange(log.size()[0]))
 log_lists = [build_log_list(x["data_valid"],x["scales_valid"]) for x in configs]
 unique_dsets = np.unique([x for y in log_lists for x in y])
 print("... unique datsets are {}".format(unique_dsets))
@@ -59,7 +66,7 @@ num_uni_all = len(unique_all_dsets)
 fig, ax = plt.subplots(1, num_uni_all, figsize=(5*num_uni_all,5))
 for il, dset in enumerate(unique_all_dsets):
     for i in range(len(logs)):
-        xs = np.arange(logs[i].size()[0])
+        xs = epochs[i]
         for j in range(len(value_indexs)):
             index = value_indexs[j]
             legend = "{}({})".format(tags[i], value_labels[j])
@@ -17,7 +17,7 @@ import torch
 from torch.autograd import Variable
 
 from sofvsr.modules import SOFVSR as SOFVSR_NET
-from sofvsr.data_utils import ycbcr2rgb, rgb2ycbcr
+import tar.color as color
 
 class SOFVSR(object):
 
@@ -42,40 +42,19 @@ class SOFVSR(object):
         # Input preprocessing - Create Cb & Cr interpolation images.
         LR1_bicubic = torch.nn.functional.interpolate(LR1,
                         scale_factor=self._scale, mode='bilinear')
-        _, SR_cb, SR_cr = self._rgb2ycbcr(LR1_bicubic)
-        SR_cb, SR_cr = self._expand_dim(SR_cb), self._expand_dim(SR_cr)
+        SR_cbcr = color.rgb2ycbcr(LR1_bicubic)[:, 1:3, :, :]
         # Apply model to input and return outputs.
         LR_y_cube = Variable(LR_y_cube)
         if self._use_gpu: LR_y_cube = LR_y_cube.cuda()
         SR_y = self._net(LR_y_cube)
         SR_y = self._expand_dim(SR_y)
         # Image postprocessing.
-        SR_ycbcr = torch.cat((SR_y, SR_cb, SR_cr), 1)
-        SR_rgb = self._ycbcr2rgb(SR_ycbcr)
+        SR_ycbcr = torch.cat((SR_y, SR_cbcr.to(SR_y.device)), 1)
+        SR_rgb = color.ycbcr2rgb(SR_ycbcr)
         return SR_rgb
 
     def _to_y_image(self, *tensors):
-        def rgb_to_y(x):
-          x, sz = Variable(x.data.new(*x.size())), x.size()
-          x = x[:, 0, :, :]*65.481+x[:, 1, :, :]*128.553+x[:, 2, :, :]*24.966+16
-          return self._expand_dim(x/255.0)
-        return [rgb_to_y(x) for x in tensors]
-
-    def _rgb2ycbcr(self, x):
-        y  = 0.257*x[:, 0, :, :]+0.504*x[:, 1, :, :]+0.098*x[:, 2, :, :]+16/255.0
-        cb = -0.148*x[:, 0, :, :]-0.291*x[:, 1, :, :]+0.439*x[:, 2, :, :]+128/255.0
-        cr = 0.439*x[:, 0, :, :]-0.368*x[:, 1, :, :]-0.071*x[:, 2, :, :]+128/255.0
-        return y, cb, cr
-
-    def _ycbcr2rgb(self, x):
-        img_r = 1.164*(x[:, 0, :, :]-16/255.0)+1.596*(x[:, 2, :, :]-128/255.0)
-        img_r = self._expand_dim(img_r)
-        img_g = 1.164*(x[:, 0, :, :]-16/255.0)-0.392*(x[:, 1, :, :]-128/255.0)
-        img_g = img_g-0.813*(x[:, 2, :, :]-128/255.0)
-        img_g = self._expand_dim(img_g)
-        img_b = 1.164*(x[:, 0, :, :]-16/255.0)+2.017*(x[:, 1, :, :]-128/255.0)
-        img_b = self._expand_dim(img_b)
-        return torch.cat((img_r,img_g,img_b), 1)
+        return [color.rgb2y(x) for x in tensors]
 
     def _expand_dim(self, x):
         if len(x.size()) == 2: x = x.unsqueeze_(0)
@@ -7,6 +7,8 @@ from torch.utils.data.dataset import Dataset
 import math
 import random
 
+import tar.color as color
+
 class TrainsetLoader(Dataset):
     def __init__(self, trainsets, upscale_factor, patch_size, n_iters):
         super(TrainsetLoader).__init__()
@@ -155,23 +157,13 @@ def toTensor(img):
 
 def rgb2ycbcr(img_rgb):
     ## the range of img_rgb should be (0, 1)
-    img_y = 0.257 * img_rgb[:, :, 0] + 0.504 * img_rgb[:, :, 1] + 0.098 * img_rgb[:, :, 2] + 16 / 255.0
-    img_cb = -0.148 * img_rgb[:, :, 0] - 0.291 * img_rgb[:, :, 1] + 0.439 * img_rgb[:, :, 2] + 128 / 255.0
-    img_cr = 0.439 * img_rgb[:, :, 0] - 0.368 * img_rgb[:, :, 1] - 0.071 * img_rgb[:, :, 2] + 128 / 255.0
-    return img_y, img_cb, img_cr
+    img_ycbcr = color.to_numpy(color.rgb2ycbcr(color.from_numpy(img_rgb)))
+    return img_ycbcr[:, :, 0], img_ycbcr[:, :, 1], img_ycbcr[:, :, 2]
 
 def ycbcr2rgb(img_ycbcr):
     ## the range of img_ycbcr should be (0, 1)
-    img_r = 1.164 * (img_ycbcr[:, :, 0] - 16 / 255.0) + 1.596 * (img_ycbcr[:, :, 2] - 128 / 255.0)
-    img_g = 1.164 * (img_ycbcr[:, :, 0] - 16 / 255.0) - 0.392 * (img_ycbcr[:, :, 1] - 128 / 255.0) - 0.813 * (img_ycbcr[:, :, 2] - 128 / 255.0)
-    img_b = 1.164 * (img_ycbcr[:, :, 0] - 16 / 255.0) + 2.017 * (img_ycbcr[:, :, 1] - 128 / 255.0)
-    img_r = img_r[:, :, np.newaxis]
-    img_g = img_g[:, :, np.newaxis]
-    img_b = img_b[:, :, np.newaxis]
-    img_rgb = np.concatenate((img_r, img_g, img_b), 2)
-    return img_rgb
+    return color.to_numpy(color.ycbcr2rgb(color.from_numpy(img_ycbcr)))
 
 def rgb2y(img_rgb):
     ## the range of img_rgb should be (0, 1)
-    image_y = 0.257 * img_rgb[:, :, 0] + 0.504 * img_rgb[:, :, 1] + 0.098 * img_rgb[:, :, 2] +16 / 255.0
-    return image_y
+    return color.to_numpy(color.rgb2y(color.from_numpy(img_rgb)))[:, :, 0]
@@ -1,5 +1,6 @@
 import tar.dataloader
 import tar.datasets
+import tar.evaluation
 import tar.miscellaneous
 import tar.modules
 import tar.optimization
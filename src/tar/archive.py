@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Delta compressed archive of per-epoch model states. Keyframe
+#               epochs are stored as full state dicts (model_{epoch}.pt), all
+#               other epochs as lossless deltas to their keyframe (XOR of the
+#               raw bytes, split into byte planes and zlib compressed) in
+#               model_{epoch}.delta, so that every epoch can be restored from
+#               its keyframe and a single delta.
+# =============================================================================
+import os
+import time
+import zlib
+from typing import Dict
+
+import numpy as np
+
+import torch
+
+def _bytes(x: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(x).reshape(-1).view(np.uint8)
+
+def encode(x: torch.Tensor, key: torch.Tensor, level: int) -> bytes:
+    """ Compress tensor x as XOR of its bytes and the bytes of key (same
+    dtype and shape), split into byte planes (i.e. all most significant
+    bytes first) which are mostly zero for small updates. """
+    x, key = x.numpy(), key.numpy()
+    delta = np.bitwise_xor(_bytes(x), _bytes(key))
+    planes = delta.reshape(-1, x.itemsize).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), level)
+
+def decode(data: bytes, key: torch.Tensor) -> torch.Tensor:
+    """ Restore tensor from its encoding (see encode) and key. """
+    key = key.numpy()
+    planes = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    delta = planes.reshape(key.itemsize, -1).T.reshape(-1)
+    x = np.bitwise_xor(delta, _bytes(key)).view(key.dtype).reshape(key.shape)
+    return torch.from_numpy(x.copy())
+
+def load(directory: str, epoch: int) -> Dict[str, torch.Tensor]:
+    """ Load state dict of epoch from the archive in directory. """
+    path = os.path.join(directory, "model_{}.pt".format(epoch))
+    if os.path.exists(path): return torch.load(path, map_location="cpu")
+    delta = torch.load(os.path.join(directory, "model_{}.delta".format(epoch)))
+    key = torch.load(os.path.join(directory, "model_{}.pt".format(delta["key"])),
+                     map_location="cpu")
+    state = type(key)()
+    for name, x in delta["tensors"].items():
+        state[name] = decode(x, key[name]) if isinstance(x, bytes) else x
+    return state
+
+class _EpochArchive_(object):
+    """ Writer of the epoch archive, storing a keyframe every keyframe_every
+    epochs (and after restarts) and deltas to the keyframe otherwise. The
+    sizes and save times are accumulated in stats, with the full size and
+    save time of the keyframes as reference. """
+
+    def __init__(self, keyframe_every: int, compression: int=6):
+        self.keyframe_every = keyframe_every
+        self.compression = compression
+        self.key, self.key_epoch = None, None
+        self.stats = {"epochs": 0, "bytes": 0, "bytes_full": 0, "time": 0.0,
+                      "keyframes": 0, "time_keyframes": 0.0}
+
+    def save(self, directory: str, state: Dict[str, torch.Tensor], epoch: int):
+        """ Save (cpu) state dict of epoch. """
+        t0 = time.perf_counter()
+        if self.key is None or epoch - self.key_epoch >= self.keyframe_every:
+            path = os.path.join(directory, "model_{}.pt".format(epoch))
+            self._save(state, path)
+            self.key, self.key_epoch = state, epoch
+            self.stats["keyframes"] += 1
+            self.stats["time_keyframes"] += time.perf_counter() - t0
+        else:
+            tensors = {}
+            for name, x in state.items():
+                key = self.key.get(name)
+                if key is None or key.dtype != x.dtype or key.shape != x.shape:
+                    tensors[name] = x
+                else:
+                    tensors[name] = encode(x, key, self.compression)
+            path = os.path.join(directory, "model_{}.delta".format(epoch))
+            self._save({"key": self.key_epoch, "tensors": tensors}, path)
+        self.stats["epochs"] += 1
+        self.stats["time"] += time.perf_counter() - t0
+        self.stats["bytes"] += os.path.getsize(path)
+        self.stats["bytes_full"] += sum([x.numel()*x.element_size()
+                                         for x in state.values()])
+
+    @staticmethod
+    def _save(obj, path: str):
+        torch.save(obj, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def summary(self) -> str:
+        s = self.stats
+        if s["epochs"] == 0: return "Model archive: empty"
+        time_full = s["time_keyframes"]/max(s["keyframes"], 1)
+        return "Model archive: {} epochs in {:.1f} MB (full: {:.1f} MB, " \
+               "{:.1f}x), save {:.3f}s/epoch (full: {:.3f}s/epoch)".format(
+               s["epochs"], s["bytes"]/1e6, s["bytes_full"]/1e6,
+               s["bytes_full"]/max(s["bytes"], 1), s["time"]/s["epochs"],
+               time_full)
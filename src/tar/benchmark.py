@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Latency benchmark of the encoding (downscaling) and decoding
+#               (upscaling) of a model, with warm-up iterations, repeated
+#               timed runs, latency percentiles and throughput, swept over
+#               the number of (cpu) threads and batch sizes.
+# =============================================================================
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import torch
+
+class _Benchmark_(object):
+    """ Time functions on the device (synchronized for cuda) and collect
+    the resulting records of several datasets in one report. """
+
+    percentiles = [50, 90, 99]
+
+    def __init__(self, device: torch.device, warmup: int, repeats: int,
+                 threads: List[int], batch_sizes: List[int]):
+        self.device  = device
+        self.warmup  = warmup
+        self.repeats = repeats
+        self.threads = [x for x in threads if x > 0] or [torch.get_num_threads()]
+        self.batch_sizes = batch_sizes
+        self.records = []
+
+    def _sync(self):
+        if self.device.type == "cuda": torch.cuda.synchronize(self.device)
+
+    def time(self, fn: Callable, warmup: int=None, repeats: int=None
+             ) -> List[float]:
+        """ Run fn warmup times and return the latencies [s] of repeated
+        (timed) runs, by default as configured. """
+        warmup  = self.warmup if warmup is None else warmup
+        repeats = self.repeats if repeats is None else repeats
+        for _ in range(warmup): fn()
+        times = []
+        for _ in range(repeats):
+            self._sync()
+            t0 = time.perf_counter()
+            fn()
+            self._sync()
+            times.append(time.perf_counter() - t0)
+        return times
+
+    def configs(self):
+        """ Iterate over all (threads, batch size) configurations, while
+        setting the number of threads (restored afterwards). """
+        num_threads = torch.get_num_threads()
+        try:
+            for threads in self.threads:
+                torch.set_num_threads(threads)
+                for batch_size in self.batch_sizes:
+                    yield threads, batch_size
+        finally:
+            torch.set_num_threads(num_threads)
+
+    def summary(self, times: List[float], pixels: int) -> Dict[str, float]:
+        """ Latency percentiles [s] and throughput [megapixels/s] of the
+        runs, with pixels the number of (output) pixels of a run. """
+        times = np.asarray(times)
+        stats = {"p{}".format(p): float(np.percentile(times, p))
+                 for p in self.percentiles}
+        stats["mean"] = float(times.mean())
+        stats["mps"] = float(pixels*len(times)/times.sum()/1e6)
+        return stats
+
+    def add(self, record: dict):
+        self.records.append(record)
+
+    def report(self, **meta) -> dict:
+        """ Return report of all records and the environment, so that reports
+        of different runs can be compared. """
+        env = {"torch": torch.__version__, "device": str(self.device),
+               "warmup": self.warmup, "repeats": self.repeats}
+        if self.device.type == "cuda":
+            env["device_name"] = torch.cuda.get_device_name(self.device)
+        env.update(meta)
+        return {"environment": env, "records": self.records}
+
+    def clear(self):
+        self.records = []
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Batched color space conversions of image tensors (b,3,h,w)
+#               with values in [0,1] (float) or [0,255] (uint8) on any
+#               device. Linear conversions are computed as one batched 3x3
+#               matrix multiplication plus offset (baddbmm), optionally into
+#               a given output buffer. Conversions follow the ITU-R BT.601
+#               (YCbCr) and sRGB/D65 (Lab) conventions used by skimage.
+# =============================================================================
+import numpy as np
+
+import torch
+
+# =============================================================================
+# Conversion matrices.
+# =============================================================================
+ycbcr_from_rgb = np.array([[ 65.481, 128.553,  24.966],
+                           [-37.797, -74.203, 112.0  ],
+                           [112.0  , -93.786, -18.214]])/255.0
+ycbcr_offset = np.array([16.0, 128.0, 128.0])/255.0
+rgb_from_ycbcr = np.linalg.inv(ycbcr_from_rgb)
+
+gray_from_rgb = np.array([[0.2125, 0.7154, 0.0721]])
+
+xyz_from_rgb = np.array([[0.412453, 0.357580, 0.180423],
+                         [0.212671, 0.715160, 0.072169],
+                         [0.019334, 0.119193, 0.950227]])
+xyz_ref_white = np.array([0.95047, 1.0, 1.08883])
+lab_from_fxyz = np.array([[  0.0, 116.0,    0.0],
+                          [500.0, -500.0,   0.0],
+                          [  0.0, 200.0, -200.0]])
+lab_offset = np.array([-16.0, 0.0, 0.0])
+
+# =============================================================================
+# Conversion kernels.
+# =============================================================================
+def linear(x: torch.Tensor, matrix: np.ndarray, offset: np.ndarray=None,
+           out: torch.Tensor=None) -> torch.Tensor:
+    """ Apply out = matrix @ x + offset to every pixel of x (b,c,h,w) in one
+    batched matrix multiplication. uint8 images are scaled to [0,1] by
+    scaling the matrix. The output buffer (b,k,h,w) has to be contiguous. """
+    scale = 1.0
+    if x.dtype == torch.uint8: x, scale = x.float(), 1/255.0
+    b, c, h, w = x.shape
+    k = matrix.shape[0]
+    m = torch.tensor(matrix*scale, dtype=x.dtype, device=x.device)
+    if offset is None: offset = np.zeros(k)
+    o = torch.tensor(offset, dtype=x.dtype, device=x.device).view(1,k,1)
+    if out is None: out = x.new_empty((b,k,h,w))
+    torch.baddbmm(o.expand(b,k,h*w), m.expand(b,k,c), x.reshape(b,c,h*w),
+                  out=out.view(b,k,h*w))
+    return out
+
+def _as_float(x: torch.Tensor) -> torch.Tensor:
+    if x.dtype == torch.uint8: return x.float().div_(255.0)
+    return x
+
+def rgb2ycbcr(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    return linear(x, ycbcr_from_rgb, ycbcr_offset, out=out)
+
+def ycbcr2rgb(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    offset = -rgb_from_ycbcr.dot(ycbcr_offset)
+    return linear(x, rgb_from_ycbcr, offset, out=out)
+
+def rgb2y(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    return linear(x, ycbcr_from_rgb[0:1], ycbcr_offset[0:1], out=out)
+
+def rgb2gray(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    return linear(x, gray_from_rgb, out=out)
+
+def rgb2hue(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    """ Hue channel of HSV color space in [0,1] (as skimage's rgb2hsv). """
+    x = _as_float(x)
+    r, g, b = x[:,0:1], x[:,1:2], x[:,2:3]
+    v = x.max(dim=1, keepdim=True)[0]
+    delta = v - x.min(dim=1, keepdim=True)[0]
+    delta_safe = torch.where(delta == 0, torch.ones_like(delta), delta)
+    h = (g - b)/delta_safe
+    h = torch.where(g == v, 2.0 + (b - r)/delta_safe, h)
+    h = torch.where(b == v, 4.0 + (r - g)/delta_safe, h)
+    h = torch.fmod(torch.fmod(h/6.0, 1.0) + 1.0, 1.0)
+    h = torch.where(delta == 0, torch.zeros_like(h), h)
+    if out is None: return h
+    return out.copy_(h)
+
+def rgb2lab(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    """ Convert sRGB to CIE-Lab (D65, 2 degree observer), by linearizing the
+    sRGB values, a matrix multiplication to XYZ (normalized by the reference
+    white), the cube root (linear near zero) and a matrix multiplication plus
+    offset to Lab. """
+    x = _as_float(x)
+    x = torch.where(x > 0.04045, ((x + 0.055)/1.055)**2.4, x/12.92)
+    fxyz = linear(x, xyz_from_rgb/xyz_ref_white[:,np.newaxis])
+    fxyz = torch.where(fxyz > 0.008856, fxyz.clamp(min=0)**(1/3.0),
+                       7.787*fxyz + 16/116.0)
+    return linear(fxyz, lab_from_fxyz, lab_offset, out=out)
+
+def lab2rgb(x: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+    """ Convert CIE-Lab (D65, 2 degree observer) to sRGB in [0,1], inverse
+    of rgb2lab (negative z values and out of gamut colors are clipped). """
+    fxyz = linear(x, np.linalg.inv(lab_from_fxyz),
+                  -np.linalg.inv(lab_from_fxyz).dot(lab_offset))
+    fxyz = torch.where(fxyz > 0.2068966, fxyz**3, (fxyz - 16/116.0)/7.787)
+    fxyz[:,2:3].clamp_(min=0)
+    x = linear(fxyz, np.linalg.inv(xyz_from_rgb/xyz_ref_white[:,np.newaxis]))
+    x = torch.where(x > 0.0031308, 1.055*x.clamp(min=0)**(1/2.4) - 0.055,
+                    x*12.92)
+    if out is None: return x.clamp_(0, 1)
+    return torch.clamp(x, 0, 1, out=out)
+
+# =============================================================================
+# Numpy images.
+# =============================================================================
+def from_numpy(img: np.ndarray) -> torch.Tensor:
+    """ Convert numpy image (h,w,c) to tensor batch (1,c,h,w). """
+    if img.ndim == 2: img = img[:,:,np.newaxis]
+    img = np.ascontiguousarray(img.transpose((2, 0, 1)))
+    return torch.from_numpy(img).unsqueeze(0)
+
+def to_numpy(x: torch.Tensor) -> np.ndarray:
+    """ Convert tensor batch (1,c,h,w) to numpy image (h,w,c). """
+    return x[0].permute(1, 2, 0).cpu().numpy()
@@ -5,20 +5,30 @@
 # Description : Loading data front end class.
 # =============================================================================
 import argparse
+from collections import OrderedDict
+import hashlib
 import imageio
 import importlib
+import json
+from multiprocessing import Value
 import numpy as np
 import os
 import glob
+import queue
 import random
-import skimage.color as sc
+import struct
+import threading
+import traceback
 from typing import List, Tuple
 
+import torch
 from torch import from_numpy, Tensor
+import torch.multiprocessing as mp
 from torch.utils.data import ConcatDataset, Dataset, DataLoader
 from torch.utils.data.dataloader import default_collate
-from torch.utils.data.sampler import RandomSampler
+from torch.utils.data.sampler import BatchSampler, RandomSampler, Sampler
 
+import tar.color as color
 import tar.miscellaneous as misc
 
 class _Dataset_(Dataset):
@@ -31,9 +41,17 @@ class _Dataset_(Dataset):
         self.name = name
         self.train = train
         self.scale = scale
+        self.shards = {}
+        self.device_preprocess = not args.no_device_preprocess
+        self.cache = None
+        if args.cache_size > 0:
+            self.cache = _SharedCache_(args.cache_dir, args.cache_size*2**20)
         self._set_filesystem(args.dir_data)
         list_hr, list_lr = self._scan()
         self.images_hr, self.images_lr = list_hr, list_lr
+        self.shapes_lr = [self._shape(f) for f in list_lr]
+        if args.lr_pyramid: self.shapes_lr = [self._shape_lr(f) for f in list_hr]
+        self._check_shapes()
         max_samples = self.args.max_test_samples
         self.sample_size = min(self.__len__(), max_samples)
         if not self.is_sampled(): self.sample_size = self.__len__()
@@ -50,7 +68,7 @@ class _Dataset_(Dataset):
     def _scan(self):
         """ Scan given lists of directories for HR and LR images and return
         list of HR and LR absolute file paths. """
-        names_hr = sorted(glob.glob(self.dir_hr + "/*" + ".png"))
+        names_hr = _Manifest_.open(self.dir_hr).paths()
         # Check if scale == 1, then just return HR images.
         if self.scale == 1: return names_hr, names_hr
         # Otherwise build LR image names for every HR image.
@@ -60,21 +78,139 @@ class _Dataset_(Dataset):
             names_lr.append(self.dir_lr + "/{}x{}.png".format(filename,self.scale))
         return names_hr, names_lr
 
-    def _load_file(self, idx: int):
+    def _load_file(self, idx: int, hr: np.ndarray=None):
+        """ Load LR and HR image (evenly cropped) of item idx. The HR image
+        is only decoded if it is not given (see _load_hr). """
         f_hr, f_lr = self.images_hr[idx], self.images_lr[idx]
         filename, _ = os.path.splitext(os.path.basename(f_hr))
-        hr, lr = imageio.imread(f_hr), imageio.imread(f_lr)
-        lr, hr = self._expand_dimension(lr), self._expand_dimension(hr)
-        wl, hl = lr.shape[0]//2*2, lr.shape[1]//2*2
+        if hr is None: hr = self._load_hr(idx)
+        if self.args.lr_pyramid and self.scale > 1:
+            # LR image is built from the (cropped) HR image when cutting the
+            # patch, see _cut_patch().
+            wl, hl = self.shapes_lr[idx][0]//2*2, self.shapes_lr[idx][1]//2*2
+            return None, hr[:wl*self.scale,:hl*self.scale,:], filename
+        # Without scaling LR and HR image are the same file, decode it once.
+        lr = hr if f_lr == f_hr else self._expand_dimension(self._load_image(f_lr))
+        # Crop to even LR size (known from the manifest without decoding).
+        shape_lr = self.shapes_lr[idx] if self.shapes_lr[idx] else lr.shape
+        wl, hl = shape_lr[0]//2*2, shape_lr[1]//2*2
         lr, hr = lr[:wl,:hl,:], hr[:wl*self.scale,:hl*self.scale,:]
         assert hr.shape[2] == lr.shape[2]
         assert hr.shape[0] == self.scale*lr.shape[0]
         assert hr.shape[1] == self.scale*lr.shape[1]
         return lr, hr, filename
 
+    def _load_hr(self, idx: int) -> np.ndarray:
+        return self._expand_dimension(self._load_image(self.images_hr[idx]))
+
+    def _shape(self, path: str):
+        """ Return image shape (h,w,c) of file from its directory's manifest,
+        or None if the file does not exist. """
+        directory, name = os.path.split(path)
+        return _Manifest_.open(directory).shape(name)
+
+    def _shape_lr(self, path_hr: str):
+        """ Return LR image shape given its HR image, when downscaling it. """
+        shape = self._shape(path_hr)
+        if shape is None: return None
+        return shape[0]//self.scale, shape[1]//self.scale, shape[2]
+
+    def _check_shapes(self):
+        """ Check that every HR image is (at least) scale times as large as
+        its evenly cropped LR image, using the image dimensions stored in the
+        manifests instead of decoding the images. """
+        if self.scale == 1: return
+        invalid = []
+        for f_hr, shape_lr in zip(self.images_hr, self.shapes_lr):
+            shape_hr = self._shape(f_hr)
+            if shape_hr is None or shape_lr is None:
+                invalid.append(os.path.basename(f_hr))
+                continue
+            wl, hl = shape_lr[0]//2*2, shape_lr[1]//2*2
+            if shape_hr[0] < wl*self.scale or shape_hr[1] < hl*self.scale:
+                invalid.append(os.path.basename(f_hr))
+        if len(invalid) > 0:
+            raise ValueError("Invalid or missing images in {}x{}: {}".format(
+                self.name, self.scale, ",".join(invalid)))
+
+    def _load_image(self, path: str) -> np.ndarray:
+        """ Load image from its packed shard (if packing is enabled and the
+        image has been packed) or decode it from the png file otherwise. """
+        directory, name = os.path.split(path)
+        if self.args.packed:
+            if not directory in self.shards:
+                self.shards[directory] = _PackedDataset_.open(directory)
+            shard = self.shards[directory]
+            if shard is not None and name in shard: return shard[name]
+        if self.cache is not None: return self.cache.load(path, imageio.imread)
+        return imageio.imread(path)
+
     # =========================================================================
     # File loading functions.
     # =========================================================================
+    def _cut_patch(self, lr, hr: np.ndarray, idx: int, do_train: bool):
+        """ Cut patch from loaded images, if no LR image has been loaded
+        build it from the HR patch region (see _get_patch_downscaled). """
+        patch_size = self.args.patch_size
+        assert patch_size <= hr.shape[0] and patch_size <= hr.shape[1]
+        if lr is not None:
+            return self._get_patch(lr, hr, self.scale, patch_size, do_train)
+        if do_train or self.cache is None:
+            return self._get_patch_downscaled(hr, patch_size, do_train)
+        # Memoize full LR images (not training) in the shared cache.
+        f_hr = self.images_hr[idx]
+        lr = self.cache.load(f_hr, lambda _: self._get_patch_downscaled(
+            hr, patch_size, False)[0], tag="x{}".format(self.scale))
+        return lr, hr
+
+    def _get_patch_downscaled(self, hr: np.ndarray, patch_size: int,
+                              do_train: bool):
+        """ Cut HR patch (or full image if not training) and build the LR
+        patch by downscaling the HR patch region, including a margin for the
+        kernel support which is reflected at the image borders (misc.downscale).
+        """
+        scale = self.scale
+        _, pad = misc.downscale_kernel(scale)
+        h, w = hr.shape[:2]
+        if do_train:
+            lp = patch_size // scale
+            lx = random.randrange(0, w//scale - lp + 1)
+            ly = random.randrange(0, h//scale - lp + 1)
+            hx, hy, hh, hw = scale*lx, scale*ly, scale*lp, scale*lp
+        else:
+            hx, hy, hh, hw = 0, 0, h, w
+        y0, y1 = max(hy - pad, 0), min(hy + hh + pad, h)
+        x0, x1 = max(hx - pad, 0), min(hx + hw + pad, w)
+        pads = [pad - (hx - x0), pad - (x1 - hx - hw),
+                pad - (hy - y0), pad - (y1 - hy - hh)]
+        region = from_numpy(np.ascontiguousarray(hr[y0:y1, x0:x1, :]))
+        region = region.permute(2, 0, 1).unsqueeze(0).float()
+        lr = misc.downscale(region, scale, pads)
+        lr = lr.clamp(0, 255).floor().byte()[0].permute(1, 2, 0).numpy()
+        return lr, hr[hy:hy + hh, hx:hx + hw, :]
+
+    def _preprocess(self, pair: List[np.ndarray], augment: bool) -> List[Tensor]:
+        # Set right number of channels.
+        pair = self._set_channel(pair)
+        # If preprocessing on the device, return uint8 tensors and leave
+        # normalization and augmentation to the trainer (batch-wise). In
+        # colorization mode merely the color image is returned, the grey
+        # input is built on the device (see misc.entcolorize), an empty
+        # tensor is returned in its place.
+        if self.device_preprocess and self.args.type == "COLORING":
+            empty = torch.zeros(0, dtype=torch.uint8)
+            return [empty] + self._np2ByteTensor(pair[1:])
+        if self.device_preprocess: return self._np2ByteTensor(pair)
+        # Normalize patches from rgb_range to [norm_min, norm_max].
+        pair = self._normalize(pair)
+        # Augment patches (if flag is set).
+        if augment: pair = self._augment(pair)
+        # In colorization mode convert "LR" image to YCbCr and take Y-channel.
+        if self.args.type=="COLORING":
+            pair[0]=self._entcolorize(pair[1].copy(),self.args.color_space)
+        # Convert to torch tensor and return.
+        return self._np2Tensor(pair)
+
     @staticmethod
     def _get_patch(lr: np.ndarray, hr: np.ndarray,
                    scale: int, patch_size: int, do_train: bool):
@@ -130,13 +266,20 @@ class _Dataset_(Dataset):
             return tensor
         return [_np2Tensor_x(x) for x in imgs]
 
+    @staticmethod
+    def _np2ByteTensor(imgs) -> List[Tensor]:
+        """ Convert uint8 images (h,w,c) to uint8 tensors (c,h,w) without
+        normalization, the permutation is a view and only made contiguous
+        when the batch is collated. """
+        def _np2ByteTensor_x(img):
+            img = np.ascontiguousarray(img, dtype=np.uint8)
+            return from_numpy(img).permute(2, 0, 1)
+        return [_np2ByteTensor_x(x) for x in imgs]
+
     @staticmethod
     def _entcolorize(img, colorspace) -> np.ndarray:
-        if colorspace == "ycbcr":  x = sc.rgb2ycbcr(img)[:,:,0]
-        elif colorspace == "hsv":  x = sc.rgb2hsv(img)[:,:,0]
-        elif colorspace == "gray": x = sc.rgb2gray(img)[:,:]
-        else: raise ValueError("Undefined colorspace {} !".format(colorspace))
-        return np.expand_dims(x, axis=2)/255.0
+        x = misc.entcolorize(color.from_numpy(img), colorspace)
+        return color.to_numpy(x)
 
     # =========================================================================
     # Miscellaneous
@@ -148,6 +291,276 @@ class _Dataset_(Dataset):
         max_samples = self.args.max_test_samples
         return not self.args.valid_only and self.sample_size == max_samples
 
+    def cache_stats(self) -> str:
+        """ Return description of the cache hits and misses of the dataset
+        (accumulated over all workers) or None if no caching is used. """
+        if self.cache is None: return None
+        return "Cache {}x{}: {}".format(self.name, self.scale, self.cache.counter)
+
+# =============================================================================
+# DATASET MANIFEST.
+# =============================================================================
+class _Manifest_(object):
+    """ Persisted index of the png images in a directory (stored next to
+    it as <directory>.manifest.json), holding the file names, image
+    dimensions, number of channels and content hashes. Dimensions and
+    channels are read from the png header, so neither building nor using
+    the manifest requires decoding an image. The manifest is invalidated by
+    modification times, i.e. the file list is rescanned if the directory's
+    mtime changed (files added or removed) and an entry is rebuilt if its
+    file's mtime or size changed. """
+
+    manifests = {}
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.normpath(directory) + ".manifest.json"
+        self.entries = {}
+        self._update()
+
+    @staticmethod
+    def open(directory: str):
+        """ Return (process-wide cached) manifest of directory. """
+        if not directory in _Manifest_.manifests:
+            _Manifest_.manifests[directory] = _Manifest_(directory)
+        return _Manifest_.manifests[directory]
+
+    def paths(self) -> List[str]:
+        """ Return sorted list of image file paths in directory. """
+        return [os.path.join(self.directory, x) for x in sorted(self.entries)]
+
+    def shape(self, name: str):
+        if not name in self.entries: return None
+        e = self.entries[name]
+        return e["height"], e["width"], e["channels"]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _update(self):
+        if not os.path.isdir(self.directory): return
+        entries, mtime_last = {}, None
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            entries, mtime_last = data["entries"], data["mtime"]
+        except (OSError, ValueError, KeyError):
+            pass
+        mtime = os.stat(self.directory).st_mtime_ns
+        changed = mtime != mtime_last
+        if not changed: names = sorted(entries.keys())
+        else: names = sorted([os.path.basename(x) for x in \
+                              glob.glob(os.path.join(self.directory, "*.png"))])
+        for name in names:
+            path = os.path.join(self.directory, name)
+            st = os.stat(path)
+            entry = entries.get(name, None)
+            if entry is None or entry["mtime"] != st.st_mtime_ns \
+            or entry["size"] != st.st_size:
+                entry, changed = self._build_entry(path, st), True
+            self.entries[name] = entry
+        if changed: self._write(mtime)
+
+    def _write(self, mtime: int):
+        # Datasets might be read-only, then the manifest is kept in memory.
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"mtime": mtime, "entries": self.entries}, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _build_entry(path: str, st: os.stat_result) -> dict:
+        height, width, channels = _Manifest_.read_png_header(path)
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""): sha1.update(chunk)
+        return {"mtime": st.st_mtime_ns, "size": st.st_size, "height": height,
+                "width": width, "channels": channels, "sha1": sha1.hexdigest()}
+
+    @staticmethod
+    def read_png_header(path: str):
+        """ Read image dimensions (height, width, channels) from header
+        (IHDR chunk) of png file without decoding it. """
+        with open(path, "rb") as f:
+            header = f.read(26)
+        if len(header) < 26 or header[:8] != b"\x89PNG\r\n\x1a\n":
+            raise ValueError("Invalid png file {} !".format(path))
+        width, height = struct.unpack(">II", header[16:24])
+        channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}[header[25]]
+        return height, width, channels
+
+# =============================================================================
+# PACKED IMAGE STORE.
+# =============================================================================
+class _PackedDataset_(object):
+    """ Read-only view of a packed image directory, i.e. all png images of
+    the directory stored as raw uint8 arrays in one memory-mapped shard
+    (<directory>.bin) and an index (<directory>.json) mapping every file
+    name to its offset and shape. Images are returned as views of the memory
+    map, so cropping a patch reads only the touched pages and nothing has
+    to be decoded. Shards are built once using _PackedDataset_.pack(). """
+
+    def __init__(self, directory: str):
+        self.path = self.shard_path(directory)
+        with open(self.path + ".json", "r") as f:
+            self.index = json.load(f)
+        self._data = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        # Open memory map lazily, so that every loader worker opens its
+        # own map instead of inheriting (or pickling) the parent's one.
+        if self._data is None:
+            self._data = np.memmap(self.path+".bin", dtype=np.uint8, mode="r")
+        offset, shape = self.index[name]
+        size = int(np.prod(shape))
+        return self._data[offset:offset+size].reshape(shape)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @staticmethod
+    def shard_path(directory: str) -> str:
+        return os.path.normpath(directory)
+
+    @staticmethod
+    def open(directory: str):
+        """ Return packed view of directory or None if it is not packed. """
+        path = _PackedDataset_.shard_path(directory)
+        if not os.path.isfile(path + ".bin"): return None
+        if not os.path.isfile(path + ".json"): return None
+        return _PackedDataset_(directory)
+
+    @staticmethod
+    def pack(directory: str, callback=None) -> int:
+        """ Decode every png image in directory (expanded to three channels)
+        and append it to the directory's shard, return number of images. The
+        shard and index are written to temporary files first and moved in
+        place afterwards, so that loaders never see a partial shard. """
+        path  = _PackedDataset_.shard_path(directory)
+        files = sorted(glob.glob(os.path.join(directory, "*.png")))
+        index, offset = {}, 0
+        with open(path + ".bin.tmp", "wb") as f:
+            for i, file in enumerate(files):
+                img = _Dataset_._expand_dimension(imageio.imread(file))
+                img = np.ascontiguousarray(img, dtype=np.uint8)
+                f.write(img.tobytes())
+                index[os.path.basename(file)] = [offset, list(img.shape)]
+                offset += img.nbytes
+                if callback is not None: callback(i+1, len(files))
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".bin.tmp", path + ".bin")
+        os.replace(path + ".json.tmp", path + ".json")
+        return len(files)
+
+# =============================================================================
+# CACHE HIT COUNTER.
+# =============================================================================
+class _HitCounter_(object):
+    """ Counter of cache hits and misses in shared memory, so that loader
+    workers contribute to the counters of the parent process. """
+
+    def __init__(self):
+        self.hits, self.misses = Value("l", 0), Value("l", 0)
+
+    def hit(self):
+        with self.hits.get_lock(): self.hits.value += 1
+
+    def miss(self):
+        with self.misses.get_lock(): self.misses.value += 1
+
+    def __str__(self) -> str:
+        hits, misses = self.hits.value, self.misses.value
+        rate = hits/max(hits + misses, 1)*100
+        return "{} hits, {} misses ({:.1f}% hit rate)".format(hits,misses,rate)
+
+# =============================================================================
+# SHARED DECODED IMAGE CACHE.
+# =============================================================================
+class _SharedCache_(object):
+    """ Node-level cache of decoded images which is shared by all loader
+    workers and all training processes on a node. Every decoded image is
+    stored as numpy file in a shared memory directory (e.g. /dev/shm) and read
+    back as memory map. The cache is bounded by a memory budget [bytes], when
+    exceeded the least recently used images (modification time is updated on
+    every hit) are evicted. Hits and misses are counted in shared memory, so
+    that the loader workers contribute to the counters of the parent. """
+
+    def __init__(self, directory: str, budget: int):
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory, exist_ok=True)
+        self.counter = _HitCounter_()
+
+    def load(self, path: str, loader, tag: str=""):
+        """ Return cached image of given file path, if not cached load it
+        using the loader function and insert it into the cache. Images derived
+        from the file (e.g. downscaled) are cached under an additional tag. """
+        file = os.path.join(self.directory, self._key(path, tag))
+        try:
+            img = np.load(file, mmap_mode="r")
+            self._touch(file)
+            self.counter.hit()
+            return img
+        except (FileNotFoundError, ValueError):
+            pass
+        img = loader(path)
+        self.counter.miss()
+        self._insert(file, img)
+        return img
+
+    @staticmethod
+    def _key(path: str, tag: str) -> str:
+        # Key depends on file's path, modification time and size, so that
+        # changed files are not served from the cache.
+        st = os.stat(path)
+        key = "{}:{}:{}:{}".format(
+            os.path.abspath(path), st.st_mtime_ns, st.st_size, tag)
+        return hashlib.sha1(key.encode()).hexdigest() + ".npy"
+
+    @staticmethod
+    def _touch(file: str):
+        try: os.utime(file)
+        except FileNotFoundError: pass
+
+    def _insert(self, file: str, img: np.ndarray):
+        if img.nbytes > self.budget: return
+        self._evict(self.budget - img.nbytes)
+        # Write to temporary file and move it in place, so that concurrent
+        # readers never see a partially written image.
+        tmp = "{}.{}.tmp".format(file, os.getpid())
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(img))
+        os.replace(tmp, file)
+
+    def _evict(self, budget: int):
+        entries = []
+        for e in os.scandir(self.directory):
+            if not e.name.endswith(".npy"): continue
+            try: st = e.stat()
+            except FileNotFoundError: continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+        used = sum([x[1] for x in entries])
+        for _, size, path in sorted(entries):
+            if used <= budget: break
+            try: os.remove(path)
+            except FileNotFoundError: pass
+            used -= size
+
 # =============================================================================
 # DATASET EXTENSION FOR IMAGES.
 # =============================================================================
@@ -158,28 +571,43 @@ class _IDataset_(_Dataset_):
     def __init__(self, args, train: bool, scale: int, name: str=""):
         super(_IDataset_,self).__init__(args,train,scale,name)
         self.format = "IMAGE"
+        self.patches = []
 
     def __getitem__(self, idx: int):
-        # Load image file.
-        lr, hr, filename = self._load_file(idx)
-        # Cut patches from file.
-        patch_size = self.args.patch_size
-        assert patch_size <= hr.shape[0] and patch_size <= hr.shape[1]
-        pair = self._get_patch(lr, hr, self.scale, patch_size, self.train)
-        # Normalize patches from rgb_range to [norm_min, norm_max].
-        pair = self._normalize(pair)
-        # Augment patches (if flag is set).
-        if not self.args.no_augment and not self.args.valid_only and self.train:
-            pair = self._augment(pair)
-        # Set right number of channels.
-        pair = self._set_channel(pair)
-        # In colorization mode convert "LR" image to YCbCr and take Y-channel.
-        if self.args.type=="COLORING":
-            pair[0]=self._entcolorize(pair[1].copy(),self.args.color_space)
-        # Convert to torch tensor and return.
-        pair_t = self._np2Tensor(pair)
+        return self._get_item(idx)
+
+    def _get_item(self, idx: int, hr: np.ndarray=None):
+        """ Return preprocessed item idx, reusing the decoded HR image if it
+        is given (see _MultiScaleDataset_). """
+        k = self.args.patches_per_decode
+        if k > 1 and self.train and not self.args.valid_only:
+            lr, hr, filename = self._get_buffered_patch(idx, k)
+        else:
+            # Load image file.
+            lr, hr, filename = self._load_file(idx, hr)
+            # Cut patches from file.
+            lr, hr = self._cut_patch(lr, hr, idx, self.train)
+        augment = not self.args.no_augment and not self.args.valid_only
+        pair_t = self._preprocess([lr, hr], augment=augment and self.train)
         return pair_t[0], pair_t[1], filename
 
+    def _get_buffered_patch(self, idx: int, k: int):
+        """ Cut k random patches from every decoded image and return a random
+        patch from the (per worker) shuffle buffer. The buffer is refilled by
+        decoding image idx as long as it holds less than k*batch_size patches,
+        so that every batch mixes patches of about batch_size images while
+        only every k-th item requires decoding an image. """
+        if len(self.patches) < k*self.args.batch_size:
+            lr, hr, filename = self._load_file(idx)
+            for _ in range(k):
+                pair = self._cut_patch(lr, hr, idx, True)
+                pair = [np.ascontiguousarray(x) for x in pair]
+                self.patches.append((pair[0], pair[1], filename))
+        # Pop random patch from buffer (swap with last element).
+        i = random.randrange(len(self.patches))
+        self.patches[i], self.patches[-1] = self.patches[-1], self.patches[i]
+        return self.patches.pop()
+
 # =============================================================================
 # DATASET EXTENSION FOR VIDEO DATA.
 # =============================================================================
@@ -190,37 +618,131 @@ class _VDataset_(_Dataset_):
     def __init__(self, args, train: bool, scale: int, name: str=""):
         super(_VDataset_, self).__init__(args,train,scale,name)
         self.format = "VIDEO"
+        self.frames = OrderedDict()
+        self.frames_counter = _HitCounter_()
 
     def __getitem__(self, idx: int):
         # Load image file.
         idx = max(min(idx, self.__len__() - 3), 0)
-        lr0, hr0, fname0 = self._load_file(idx)
-        lr1, hr1, fname1 = self._load_file(idx + 1)
-        lr2, hr2, fname2 = self._load_file(idx + 2)
+        lr0, hr0, fname0 = self._load_frame(idx)
+        lr1, hr1, fname1 = self._load_frame(idx + 1)
+        lr2, hr2, fname2 = self._load_frame(idx + 2)
         # Iterate over and process all files in returned array.
         lrs, hrs, fnames = [], [], []
-        for lr,hr,filename in zip([lr0,lr1,lr2],[hr0,hr1,hr2],[fname0,fname1,fname2]):
-            # Cut patches from file.
-            patch_size = self.args.patch_size
-            assert patch_size <= hr.shape[0] and patch_size <= hr.shape[1]
-            pair = self._get_patch(lr, hr, self.scale, patch_size, self.train)
-            # Normalize patches from rgb_range to [norm_min, norm_max].
-            pair = self._normalize(pair)
-            # Augment patches (if flag is set).
-            if not self.args.no_augment and not self.args.valid_only:
-                pair = self._augment(pair)
-            # Set right number of channels.
-            pair = self._set_channel(pair)
-            # In colorization mode convert "LR" image to YCbCr and take Y-channel.
-            if self.args.type == "COLORING":
-                pair[0] = self._entcolorize(pair[1].copy(),self.args.color_space)
-            # Convert to torch tensor and return.
-            pair_t = self._np2Tensor(pair)
+        for i, (lr,hr,filename) in enumerate(zip([lr0,lr1,lr2],[hr0,hr1,hr2],
+                                                 [fname0,fname1,fname2])):
+            # Cut patches from file (of frame idx + i).
+            pair = self._cut_patch(lr, hr, idx + i, self.train)
+            augment = not self.args.no_augment and not self.args.valid_only
+            pair_t = self._preprocess(list(pair), augment=augment)
             lrs.append(pair_t[0])
             hrs.append(pair_t[1])
             fnames.append(filename)
         return tuple(lrs), tuple(hrs), tuple(fnames)
 
+    def _load_frame(self, idx: int):
+        """ Load frame using a (per worker) sliding window cache of the last
+        three loaded frames, since consecutive items share two of their three
+        frames. Together with a sampler that hands contiguous index ranges to
+        every worker (_ContiguousBatchSampler_) every frame is decoded once. """
+        if idx in self.frames:
+            self.frames_counter.hit()
+            return self.frames[idx]
+        self.frames_counter.miss()
+        self.frames[idx] = self._load_file(idx)
+        while len(self.frames) > 3: self.frames.popitem(last=False)
+        return self.frames[idx]
+
+    def cache_stats(self) -> str:
+        stats = super(_VDataset_, self).cache_stats()
+        frames = "Frames {}x{}: {}".format(self.name,self.scale,self.frames_counter)
+        return frames if stats is None else stats + "\n" + frames
+
+# =============================================================================
+# MULTI-SCALE DATASET VIEW.
+# =============================================================================
+class _MultiScaleDataset_(Dataset):
+    """ View of the same dataset at several scales, returning the list of
+    items of every scale for every index. Image datasets decode every HR
+    image once for all scales (and with lr_pyramid merely downscale it),
+    other datasets (e.g. video) load every scale individually. """
+
+    def __init__(self, datasets: List[_Dataset_]):
+        super(_MultiScaleDataset_, self).__init__()
+        assert len(datasets) > 0
+        self.datasets = datasets
+        self.name = datasets[0].name
+        self.format = datasets[0].format
+        self.scales = [d.scale for d in datasets]
+        assert all([len(d) == len(datasets[0]) for d in datasets])
+        self.shared = len(datasets) > 1
+        self.shared = self.shared and all([isinstance(d, _IDataset_) and
+            d.images_hr == datasets[0].images_hr for d in datasets])
+
+    def __getitem__(self, idx: int):
+        if not self.shared: return [d[idx] for d in self.datasets]
+        hr = self.datasets[0]._load_hr(idx)
+        return [d._get_item(idx, hr) for d in self.datasets]
+
+    def __len__(self) -> int:
+        return len(self.datasets[0])
+
+    def is_sampled(self) -> bool:
+        return self.datasets[0].is_sampled()
+
+# =============================================================================
+# CONCATENATED DATASETS.
+# =============================================================================
+class _ConcatDataset_(ConcatDataset):
+    """ Concatenation of (training) datasets of the same format and scale,
+    which can be used in place of a single dataset. """
+
+    def __init__(self, datasets: List[_Dataset_]):
+        super(_ConcatDataset_, self).__init__(datasets)
+        self.name = "+".join([d.name for d in datasets])
+        self.format = datasets[0].format
+        self.scale = datasets[0].scale
+        assert all([d.format == self.format for d in datasets])
+        assert all([d.scale == self.scale for d in datasets])
+
+    def cache_stats(self) -> str:
+        stats = [d.cache_stats() for d in self.datasets]
+        stats = [x for x in stats if x is not None]
+        return "\n".join(stats) if len(stats) > 0 else None
+
+class _WeightedMixSampler_(Sampler):
+    """ Sampler over concatenated datasets (given their sizes), returning
+    num_samples shuffled indices per epoch of which every dataset contributes
+    a share proportional to its weight. Items of a dataset are drawn without
+    replacement, the dataset is reshuffled when it is exhausted. """
+
+    def __init__(self, sizes: List[int], weights: List[float],
+                 num_samples: int):
+        assert len(sizes) == len(weights) and all([x > 0 for x in sizes])
+        assert all([w >= 0 for w in weights]) and sum(weights) > 0
+        self.sizes = sizes
+        self.offsets = np.cumsum([0] + sizes[:-1]).tolist()
+        self.weights = [w/sum(weights) for w in weights]
+        self.num_samples = num_samples
+        # Number of items per dataset, rounding by the largest remainders.
+        counts = [int(w*num_samples) for w in self.weights]
+        remainders = [w*num_samples - c for w, c in zip(self.weights, counts)]
+        for i in np.argsort(remainders)[::-1][:num_samples - sum(counts)]:
+            counts[i] += 1
+        self.counts = counts
+
+    def __iter__(self):
+        indices = []
+        for size, offset, count in zip(self.sizes, self.offsets, self.counts):
+            draws = [torch.randperm(size) for _ in range(-(-count//size))]
+            if len(draws) == 0: continue
+            indices.append(torch.cat(draws)[:count] + offset)
+        indices = torch.cat(indices)
+        return iter(indices[torch.randperm(len(indices))].tolist())
+
+    def __len__(self) -> int:
+        return self.num_samples
+
 # =============================================================================
 # DATA LOADING CLASS.
 # =============================================================================
@@ -230,24 +752,275 @@ class _DataLoader_(DataLoader):
     - shuffle: should the dataset be shuffled before loading ?
     - num_workers:  how many subprocesses to use for data loading.
                     0 means that the data will be loaded in the main process.
-    - collate_fn: merges a list of samples to form a mini-batch. """
+    - batch_sampler: returns batches of indices (mutually exclusive with
+                    batch_size, shuffle and sampler).
+    - collate_fn: merges a list of samples to form a mini-batch.
+    The workers restore the default handlers of the snapshot signals (see
+    _pool_worker_loop). """
 
     def __init__(self, dataset,
                  batch_size,
                  shuffle=False,
                  num_workers=1,
                  sampler=None,
+                 batch_sampler=None,
                  collate_fn=default_collate):
 
+        kwargs = {"batch_size": batch_size, "shuffle": shuffle, "sampler": sampler}
+        if batch_sampler is not None: kwargs = {"batch_sampler": batch_sampler}
         super(_DataLoader_, self).__init__(
             dataset,
-            batch_size=batch_size,
-            shuffle=shuffle,
             num_workers=num_workers,
-            sampler=sampler,
             collate_fn=collate_fn,
+            worker_init_fn=_loader_worker_init,
+            **kwargs
         )
 
+def _loader_worker_init(worker_id: int):
+    misc.reset_snapshot_signals()
+
+class _ContiguousBatchSampler_(Sampler):
+    """ Batch sampler splitting the dataset into one contiguous index range
+    per loader worker. Since the data loader hands batches to its workers in
+    round-robin order, the batches of the ranges are interleaved, so that
+    every worker iterates over its range in order. """
+
+    def __init__(self, n: int, batch_size: int, num_workers: int):
+        # Split batches evenly with longer ranges first, so that the
+        # round-robin assignment stays aligned until the last batch.
+        n_workers = max(num_workers, 1)
+        batches = [list(range(i, min(i + batch_size, n))) \
+                   for i in range(0, n, batch_size)]
+        q, r = divmod(len(batches), n_workers)
+        chunks, start = [], 0
+        for w in range(n_workers):
+            end = start + q + (1 if w < r else 0)
+            chunks.append(batches[start:end])
+            start = end
+        self.batches = []
+        for i in range(max([len(x) for x in chunks] + [0])):
+            self.batches.extend([x[i] for x in chunks if i < len(x)])
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+# =============================================================================
+# PERSISTENT LOADER WORKERS.
+# =============================================================================
+def _pool_worker_loop(datasets, index_queue, data_queue, seed: int):
+    """ Worker process of the _WorkerPool_, loading and collating batches
+    of indices until receiving None. Errors are sent back as formatted
+    traceback, since not every exception can be pickled. """
+    misc.reset_snapshot_signals()
+    torch.set_num_threads(1)
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    torch.manual_seed(seed)
+    while True:
+        task = index_queue.get()
+        if task is None: break
+        run_id, i, di, indices = task
+        try:
+            data = default_collate([datasets[di][k] for k in indices])
+        except Exception:
+            data = _WorkerError_(traceback.format_exc())
+        data_queue.put((run_id, i, data))
+
+class _WorkerError_(object):
+    def __init__(self, msg: str):
+        self.msg = msg
+
+class _WorkerPool_(object):
+    """ Pool of loader worker processes which persist across epochs and
+    are shared by several datasets, in contrast to the workers of a
+    DataLoader that are forked every time it is iterated. Batches are
+    assigned to the workers round-robin (batch i to worker i % num_workers,
+    as in the DataLoader, see _ContiguousBatchSampler_) and returned in
+    order. With zero workers batches are loaded in the main process. """
+
+    def __init__(self, datasets: List[Dataset], num_workers: int,
+                 prefetch: int=2):
+        self.datasets = datasets
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.run_id = 0
+        self.index_queues, self.workers = [], []
+        self.data_queue = mp.Queue()
+        base_seed = random.randrange(2**31)
+        for w in range(num_workers):
+            index_queue = mp.Queue()
+            worker = mp.Process(target=_pool_worker_loop, args=(
+                datasets, index_queue, self.data_queue, base_seed + w))
+            worker.daemon = True
+            worker.start()
+            self.index_queues.append(index_queue)
+            self.workers.append(worker)
+
+    def run(self, di: int, batches):
+        """ Load the batches (lists of indices) of dataset di. """
+        batches = iter(batches)
+        if self.num_workers == 0:
+            for indices in batches:
+                yield default_collate([self.datasets[di][k] for k in indices])
+            return
+        # Results of previous (aborted) runs are discarded by their run id.
+        self.run_id += 1
+        sent, received, results = 0, 0, {}
+        while True:
+            while sent - received < self.prefetch*self.num_workers:
+                indices = next(batches, None)
+                if indices is None: break
+                task = (self.run_id, sent, di, list(indices))
+                self.index_queues[sent % self.num_workers].put(task)
+                sent += 1
+            if received == sent: break
+            while not received in results:
+                run_id, i, data = self._get()
+                if run_id == self.run_id: results[i] = data
+            data = results.pop(received)
+            received += 1
+            if isinstance(data, _WorkerError_):
+                raise RuntimeError("Loader worker failed:\n" + data.msg)
+            yield data
+
+    def _get(self):
+        while True:
+            try:
+                return self.data_queue.get(timeout=5.0)
+            except queue.Empty:
+                if not all([w.is_alive() for w in self.workers]):
+                    raise RuntimeError("Loader worker exited unexpectedly !")
+
+    def shutdown(self):
+        for index_queue in self.index_queues: index_queue.put(None)
+        for worker in self.workers: worker.join(timeout=5.0)
+        self.index_queues, self.workers = [], []
+
+class _PoolLoader_(object):
+    """ Data loader of one dataset of a _WorkerPool_, drawing the batches
+    from the batch sampler every time it is iterated. The batches of the
+    current iteration are kept, so that an interrupted iteration can be
+    continued from its cursor (see state_dict). """
+
+    def __init__(self, pool: _WorkerPool_, di: int, batch_sampler: Sampler):
+        self.pool = pool
+        self.di = di
+        self.dataset = pool.datasets[di]
+        self.batch_sampler = batch_sampler
+        self.batches = []
+        self.resume_state = None
+
+    def __iter__(self):
+        start = 0
+        if self.resume_state is None:
+            self.batches = [list(x) for x in self.batch_sampler]
+        else:
+            self.batches, start = self.resume_state
+            self.resume_state = None
+        return self.pool.run(self.di, self.batches[start:])
+
+    def state_dict(self, position: int) -> dict:
+        """ Return cursor of the current iteration after the first position
+        batches have been consumed. """
+        return {"batches": self.batches, "position": position}
+
+    def load_state_dict(self, state: dict):
+        """ Continue the next iteration from the given cursor. """
+        self.resume_state = (state["batches"], state["position"])
+
+    def __len__(self) -> int:
+        return len(self.batch_sampler)
+
+class _LazyDict_(dict):
+    """ Dictionary building missing values on first access. """
+
+    def __init__(self, factory):
+        super(_LazyDict_, self).__init__()
+        self.factory = factory
+
+    def __missing__(self, key):
+        self[key] = self.factory(key)
+        return self[key]
+
+# =============================================================================
+# BATCH PREFETCHING.
+# =============================================================================
+class _Prefetcher_(object):
+    """ Iterator wrapping a data loader, which keeps the next n batches
+    moved to the device already. Batches are pulled from the loader and
+    transferred in a background thread (from pinned memory on a separate
+    stream with non-blocking copies for cuda devices), so that loading and
+    transferring the data overlaps with the model computation. """
+
+    def __init__(self, loader, device: torch.device, n: int):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.device = device
+        self.n = n
+        self.cuda = device.type == "cuda"
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.cuda: self.compute_stream = torch.cuda.current_stream(self.device)
+        batches, stop = queue.Queue(maxsize=self.n), threading.Event()
+        thread = threading.Thread(target=self._transfer, args=(batches, stop))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None: break
+                if isinstance(item, Exception): raise item
+                data, event = item
+                if self.cuda: event.wait(self.compute_stream)
+                yield data
+        finally:
+            stop.set()
+            thread.join()
+
+    def _transfer(self, batches: queue.Queue, stop: threading.Event):
+        def _put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        stream = torch.cuda.Stream(self.device) if self.cuda else None
+        try:
+            for data in self.loader:
+                event = None
+                if self.cuda:
+                    with torch.cuda.stream(stream):
+                        data = self._to_device(data)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    data = self._to_device(data)
+                if not _put((data, event)): return
+        except Exception as e:
+            _put(e)
+            return
+        _put(None)
+
+    def _to_device(self, data):
+        if isinstance(data, Tensor):
+            if not self.cuda: return data.to(self.device)
+            data = data.pin_memory().to(self.device, non_blocking=True)
+            # Tensor is allocated on the transfer stream but used on the
+            # compute stream, prevent early reuse of its memory.
+            data.record_stream(self.compute_stream)
+            return data
+        elif isinstance(data, (list, tuple)):
+            return type(data)([self._to_device(x) for x in data])
+        return data
+
 # =============================================================================
 # DATA HANDLING CLASS.
 # =============================================================================
@@ -259,7 +1032,9 @@ class _Data_(object):
 
     def __init__(self, args: argparse.Namespace):
         self.loader_valid = []
-        self.loader_train = {}
+        self.loader_valid_multi = []
+        self.loader_train = _LazyDict_(lambda s: self.build_train(args, s))
+        self.pools = {}
         if args.type == "SCALING": self.init_scaling(args)
         elif args.type == "COLORING": self.init_coloring(args)
         else: raise ValueError("Invalid program type {}!".format(args.type))
@@ -271,49 +1046,89 @@ class _Data_(object):
         # from each dataset (due to comparability reasons) the testing
         # datasets are each loaded individually.
         for dataset in args.data_valid:
-            for s in args.scales_valid:
-                vset = self.load_dataset(args, dataset, train=False, scale=s)
-                sampler = RandomSampler(vset, replacement=True,
-                                        num_samples=args.max_test_samples)
-                if not vset.is_sampled(): sampler = None
-                self.loader_valid.append(_DataLoader_(
-                    vset, 1, num_workers=args.n_threads, sampler=sampler
-                ))
-        if args.valid_only: return
-        # Load training dataset, if not valid only. For training several
-        # datasets are trained in one process and therefore, each given
-        # training dataset is concatinated to one large dataset (for each scale).
-        for s in args.scales_train:
-            self.loader_train[s] = []
-            for dataset in args.data_train:
-                tset = self.load_dataset(args, dataset, train=True, scale=s)
-                shuf = args.format != "VIDEO"
-                self.loader_train[s].append(_DataLoader_(
-                tset, args.batch_size, shuffle=shuf, num_workers=args.n_threads
-                ))
+            vsets = [self.load_dataset(args, dataset, train=False, scale=s)
+                     for s in args.scales_valid]
+            self.add_valid_datasets(args, vsets)
+        # Training datasets are loaded lazily per scale (see build_train).
 
     def init_coloring(self, args: argparse.Namespace):
         # Load validation dataset. It is not about scaling here so merely the
         # scale equal one is required.
         for dataset in args.data_valid:
             vset = self.load_dataset(args, dataset, train=False, scale=1)
+            self.add_valid_datasets(args, [vset])
+        # Training datasets are loaded lazily (see build_train).
+
+    def build_train(self, args, scale: int) -> List[_PoolLoader_]:
+        """ Build training loader of all training datasets at the given scale,
+        which is done when the scale is first trained on (loader_train is a
+        _LazyDict_). Image datasets are concatenated and mixed in every batch
+        according to the data_weights (by default proportional to their
+        sizes), video datasets are loaded one after another to keep their
+        frames contiguous. All loaders share one pool of persistent workers,
+        the pools of other scales are shut down, as the training scale is
+        only increased. """
+        self.shutdown()
+        tsets = [self.load_dataset(args, dataset, train=True, scale=scale)
+                 for dataset in args.data_train]
+        if tsets[0].format != "VIDEO":
+            sizes = [len(x) for x in tsets]
+            weights = args.data_weights if args.data_weights else sizes
+            if len(weights) != len(tsets):
+                raise ValueError("Invalid data_weights {} for datasets {} !".format(
+                                 args.data_weights, args.data_train))
+            sampler = _WeightedMixSampler_(sizes, weights, sum(sizes))
+            tsets = [_ConcatDataset_(tsets)]
+        self.pools[scale] = _WorkerPool_(tsets, args.n_threads)
+        loaders = []
+        for di, tset in enumerate(tsets):
+            if tset.format == "VIDEO":
+                batch_sampler = _ContiguousBatchSampler_(
+                    len(tset), args.batch_size, args.n_threads
+                )
+            else:
+                batch_sampler = BatchSampler(sampler, args.batch_size,
+                                             drop_last=False)
+            loaders.append(_PoolLoader_(self.pools[scale], di, batch_sampler))
+        return loaders
+
+    def shutdown(self):
+        """ Shut down the persistent worker pools of the training loaders. """
+        for s in list(self.pools.keys()):
+            self.pools.pop(s).shutdown()
+            self.loader_train.pop(s, None)
+
+    def add_valid_datasets(self, args, datasets: List[_Dataset_]):
+        """ Add validation loader for every (scale of the same) dataset and
+        one loader of their multi-scale view, which is used for validation
+        together with the indices of the datasets in loader_valid. """
+        indices = []
+        for vset in datasets + [_MultiScaleDataset_(datasets)]:
             sampler = RandomSampler(vset, replacement=True,
                                     num_samples=args.max_test_samples)
             if not vset.is_sampled(): sampler = None
-            self.loader_valid.append(_DataLoader_(
-                vset, 1, num_workers=args.n_threads, sampler=sampler
-            ))
-        if args.valid_only: return
-        # Load training dataset, if not valid only. For training several
-        # datasets are trained in one process and therefore, each given
-        # training dataset is concatinated to one large dataset.
-        self.loader_train[1] = []
-        for dataset in args.data_train:
-            tset = self.load_dataset(args, dataset, train=True, scale=1)
-            shuffle = args.format != "VIDEO"
-            self.loader_train[1].append(_DataLoader_(
-            tset, args.batch_size, shuffle=shuffle, num_workers=args.n_threads
-        ))
+            loader = self.build_loader(args, vset, 1, sampler=sampler)
+            if isinstance(vset, _MultiScaleDataset_): break
+            indices.append(len(self.loader_valid))
+            self.loader_valid.append(loader)
+        self.loader_valid_multi.append((loader, indices))
+
+    @staticmethod
+    def build_loader(args, dataset, batch_size: int,
+                     shuffle: bool=False, sampler=None) -> _DataLoader_:
+        """ Build data loader for dataset. Video datasets are not shuffled
+        but each worker is given a contiguous range of (unsampled) items, so
+        that consecutive items share their frames (sliding window cache). """
+        if dataset.format == "VIDEO" and sampler is None:
+            batch_sampler = _ContiguousBatchSampler_(
+                len(dataset), batch_size, args.n_threads
+            )
+            return _DataLoader_(dataset, batch_size,
+                num_workers=args.n_threads, batch_sampler=batch_sampler
+            )
+        return _DataLoader_(dataset, batch_size, shuffle=shuffle,
+            num_workers=args.n_threads, sampler=sampler
+        )
 
     @staticmethod
     def load_dataset(args, name: str, train: bool, scale: int):
@@ -5,19 +5,16 @@
 # Description : NTIAASPEN dataset extension.
 # =============================================================================
 import os
-import glob
-import imageio
 
-from tar.dataloader import _IDataset_
+from tar.dataloader import _IDataset_, _Manifest_
 
 class INTIAASPEN(_IDataset_):
     def __init__(self, args, train, scale, name="INTIAASPEN"):
         super(INTIAASPEN, self).__init__(args, name=name, train=train, scale=scale)
 
     def _scan(self):
-        names_hr = glob.glob(self.dir_hr + "/*" + ".png")
-        for x in range(0,len(names_hr)):
-            names_hr[x] = self.dir_hr + "/hr" + str(x) + ".png"
+        num_files = len(_Manifest_.open(self.dir_hr))
+        names_hr = [self.dir_hr + "/hr" + str(x) + ".png" for x in range(num_files)]
         # Check if scale == 1, then just return HR images.
         if self.scale == 1: return names_hr, names_hr
         # Otherwise build LR image names for every HR image.
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Post-hoc evaluation of the saved epoch models of a run (see
+#               --load and --valid_epochs), concurrently in a pool of worker
+#               processes which share the validation datasets (and the
+#               decoded image cache) of the main process.
+# =============================================================================
+import queue
+import traceback
+from typing import List
+
+import torch
+import torch.multiprocessing as mp
+
+import tar.miscellaneous as misc
+import tar.modules as modules
+import tar.trainers as trainers
+
+def _worker_loop(args, loader, ckp: misc._Checkpoint_, tasks, results,
+                 worker_id: int):
+    ckp.redirect_log("log_worker_{}.txt".format(worker_id))
+    model = modules._Model_(args, ckp)
+    trainer = trainers.build_trainer(args, loader, model, None, ckp)
+    torch.set_grad_enabled(False)
+    model.eval()
+    num_descs = len(trainer.log_description())
+    while True:
+        epoch = tasks.get()
+        if epoch is None: break
+        try:
+            model.load(ckp.get_load_path("model"), resume=epoch, cpu=args.cpu)
+            ckp.step(nlogs=num_descs)
+            vs = trainer.validate_datasets(
+                finetuning=epoch >= args.fine_tuning, runtime=False)
+            results.put((epoch, ckp.log[-1].clone(), vs, None))
+        except Exception:
+            results.put((epoch, None, None, traceback.format_exc()))
+        ckp.log_file.flush()
+
+def evaluate_epochs(args, loader, ckp: misc._Checkpoint_) -> List[int]:
+    """ Evaluate the models of the valid_epochs of the loaded run (model_
+    {epoch}.pt or epoch archive) on the validation datasets, distributed
+    over valid_workers processes. The workers are forked before cuda is
+    initialized in the main process, each builds its own model and trainer
+    and logs to its own file (log_worker_{id}.txt).
+    The psnr logs of all epochs are merged in epoch order into psnr_log.pt
+    (with the epochs in psnr_epochs.pt, see evaluation/compare_psnrs.py),
+    the validation dictionaries into validations.csv. Return the evaluated
+    epochs. """
+    if args.load == "" or not args.valid_only:
+        raise ValueError("Evaluation of epochs requires --valid_only and a \
+                         run to --load !")
+    epochs = sorted(set(args.valid_epochs))
+    num_workers = max(min(args.valid_workers, len(epochs)), 1)
+    tasks, results = mp.Queue(), mp.Queue()
+    for epoch in epochs: tasks.put(epoch)
+    for _ in range(num_workers): tasks.put(None)
+    ckp.write_log("Evaluating epochs {} of {} with {} workers ...".format(
+                  epochs, ckp.dir_load, num_workers), refresh=True)
+    workers = [mp.Process(target=_worker_loop,
+                          args=(args, loader, ckp, tasks, results, wid))
+               for wid in range(num_workers)]
+    for p in workers: p.start()
+    # Collect results, as long as there are (living) workers.
+    logs, validations, num_results = {}, [], 0
+    timer = misc._Timer_()
+    while num_results < len(epochs):
+        try:
+            epoch, log, vs, error = results.get(timeout=10)
+        except queue.Empty:
+            if any([p.is_alive() for p in workers]): continue
+            ckp.write_log("... all workers exited, missing epochs {}".format(
+                          [e for e in epochs if not e in logs]))
+            break
+        num_results += 1
+        if error is not None:
+            ckp.write_log("... epoch {} failed:\n{}".format(epoch, error))
+            continue
+        logs[epoch] = log
+        for v in vs: v["epoch"] = str(epoch)
+        validations.extend(vs)
+        ckp.write_log("... evaluated epoch {} ({}/{}, {:.2f}s)".format(
+                      epoch, num_results, len(epochs), timer.toc()),
+                      refresh=True)
+    for p in workers: p.join()
+    # Merge logs and validations in epoch order.
+    epochs = sorted(logs.keys())
+    if len(epochs) == 0: return epochs
+    ckp.log = torch.stack([logs[e] for e in epochs])
+    torch.save(ckp.log, ckp.get_path("psnr_log.pt"))
+    torch.save(torch.tensor(epochs), ckp.get_path("psnr_epochs.pt"))
+    validations.sort(key=lambda v: int(v["epoch"]))
+    ckp.save_validations(validations)
+    return epochs
@@ -21,6 +21,9 @@ parser.add_argument("--no_task_aware", action="store_true",
 parser.add_argument("--load", type=str, default="",
                     help="directory to load model from, training is not \
                     continued to not overwrite, format [outs,models]xdir_name")
+parser.add_argument("--continue_from", type=str, default="",
+                    help="output directory name (instead of template and time), \
+                    training is continued from its snapshot if existing")
 parser.add_argument("--template", default="valid",
                     help="set various templates in option.py")
 parser.add_argument("--verbose", action="store_false",
@@ -31,8 +34,14 @@ parser.add_argument("--verbose", action="store_false",
 # =============================================================================
 parser.add_argument("--n_threads", type=int, default=10,
                     help="number of threads for data loading")
+parser.add_argument("--prefetch", type=int, default=2,
+                    help="number of training batches prefetched to the device \
+                    in background (0 = no prefetching)")
 parser.add_argument("--cpu", action="store_true",
                     help="use cpu only (default=False)")
+parser.add_argument("--precision", type=str, default="float32",
+                    choices=("float32", "bfloat16", "float16"),
+                    help="autocast precision of model and loss (default=float32)")
 parser.add_argument("--cuda_device", type=str, default="cuda:0",
                     help="index name of used GPU")
 parser.add_argument("--n_gpus", type=int, default=1,
@@ -46,6 +55,9 @@ parser.add_argument("--dir_data", type=str, default=os.environ["SR_PROJECT_DATA_
 parser.add_argument("--data_train", type=str, default="DIV2K",
                     help="training dataset name (>= 1 dataset!), \
                     choices=DIV2K,NTIAASPEN,INTIAASPEN")
+parser.add_argument("--data_weights", type=str, default="",
+                    help="sampling ratios of the training datasets, e.g. 1:2 \
+                    (default=proportional to dataset sizes)")
 parser.add_argument("--data_valid", default="SET5:SET14",
                     help="validation datasets names (>= 1 dataset!), \
                     choices=URBAN100,SET5,SET14,BSDS100,VDIV2K,CUSTOM, \
@@ -73,6 +85,23 @@ parser.add_argument("--color_space", type=str, default="ycbcr",
                     help="colorization guidance image color encoding")
 parser.add_argument("--no_augment", action="store_true",
                     help="use data augmentation (default=False)")
+parser.add_argument("--no_device_preprocess", action="store_true",
+                    help="normalize and augment samples in the loader workers \
+                    instead of uint8 batches on the device (default=False)")
+parser.add_argument("--patches_per_decode", type=int, default=1,
+                    help="number of training patches cut from every decoded \
+                    image, spread over batches by a shuffle buffer")
+parser.add_argument("--lr_pyramid", action="store_true",
+                    help="build LR images by downscaling the HR patch in the \
+                    loader instead of reading LR_bicubic images (default=False)")
+parser.add_argument("--packed", action="store_true",
+                    help="read images from packed memory-mapped shards if \
+                    available, build with src/datasets/pack.py (default=False)")
+parser.add_argument("--cache_size", type=int, default=0,
+                    help="memory budget of shared decoded image cache [MB] \
+                    (0 = no caching)")
+parser.add_argument("--cache_dir", type=str, default="/dev/shm/tar_cache",
+                    help="directory of shared decoded image cache")
 
 # =============================================================================
 # Model specifications.
@@ -93,6 +122,11 @@ parser.add_argument("--batch_size", type=int, default=16,
                     help="input batch size for training")
 parser.add_argument("--valid_only", action="store_true",
                     help="validate only, no training (default=False)")
+parser.add_argument("--valid_epochs", type=str, default="",
+                    help="list of epochs of the loaded run to evaluate (e.g. \
+                    [10,20,30]), instead of training or validation")
+parser.add_argument("--valid_workers", type=int, default=2,
+                    help="number of processes evaluating valid_epochs")
 
 # =============================================================================
 # Optimization specifications.
@@ -128,14 +162,36 @@ parser.add_argument("--loss", type=str, default="HR*10*L1*0+LR*1*L1*1",
 # =============================================================================
 parser.add_argument("--max_eps", type=float, default=0.5,
                     help="maximal noise for perturbation test with [0,1] image")
+parser.add_argument("--bench_samples", type=int, default=10,
+                    help="number of images per dataset for runtime benchmark")
+parser.add_argument("--bench_warmup", type=int, default=1,
+                    help="warm-up runs per image for runtime benchmark")
+parser.add_argument("--bench_repeats", type=int, default=3,
+                    help="timed runs per image for runtime benchmark")
+parser.add_argument("--bench_threads", type=str, default="[0]",
+                    help="list of thread numbers of runtime benchmark (0=current)")
+parser.add_argument("--bench_batch_sizes", type=str, default="[1]",
+                    help="list of batch sizes of runtime benchmark")
+parser.add_argument("--perturbation_samples", type=int, default=20,
+                    help="number of images per dataset for perturbation test")
+parser.add_argument("--perturbation_batch", type=int, default=10,
+                    help="number of perturbations decoded in one batch")
 parser.add_argument("--resume", type=int, default=-2,
                     help="resume from specific checkpoint (-1=latest, -2=best)")
 parser.add_argument("--save_models", action="store_true",
                     help="save all intermediate models (default=False)")
+parser.add_argument("--archive_keyframe", type=int, default=10,
+                    help="epochs between full models in the epoch archive of \
+                    save_models, others are stored as deltas (0=all full)")
 parser.add_argument("--save_results", action="store_false",
                     help="save output results (default=True)")
+parser.add_argument("--snapshot_every", type=float, default=30,
+                    help="minutes between training state snapshots (0 = only \
+                    on SIGTERM/SIGUSR1/SIGUSR2)")
 parser.add_argument("--save_every", type=int, default=20,
                     help="save output/models every x steps if save_result flag is set")
+parser.add_argument("--png_compression", type=int, default=6,
+                    help="png compression level of saved results (0-9, 0=fastest)")
 parser.add_argument("--print_every", type=int, default=20,
                     help="how many batches to wait before logging training status")
 
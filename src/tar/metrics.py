@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Batched image quality metrics (PSNR, Y-channel PSNR, SSIM),
+#               computed per sample on the device, and their streaming
+#               aggregation over a dataset with a single host sync.
+# =============================================================================
+import math
+from typing import Dict, List
+
+import torch
+
+import tar.color as color
+
+# =============================================================================
+# Metrics.
+# =============================================================================
+def psnr(x: torch.Tensor, y: torch.Tensor, data_range: float) -> torch.Tensor:
+    """ Peak signal to noise ratio of every sample of the batches x and y
+    (b,c,h,w) in float32, as misc.calc_psnr (100 for identical samples). """
+    mse = torch.pow(x.float() - y.float(), 2).view(x.shape[0], -1).mean(dim=1)
+    mse_safe = torch.where(mse == 0, torch.ones_like(mse), mse)
+    value = 20*math.log10(data_range) - 10*torch.log10(mse_safe)
+    value = torch.where(mse == 0, torch.full_like(mse, 100.0), value)
+    return value
+
+def psnr_y(x: torch.Tensor, y: torch.Tensor,
+           norm_range: List[float]) -> torch.Tensor:
+    """ PSNR of the Y-channel (YCbCr) of every sample of the normalized
+    batches x and y, single channel images are compared directly. """
+    if x.shape[1] != 3: return psnr(x, y, norm_range[1] - norm_range[0])
+    nmin, nrange = norm_range[0], norm_range[1] - norm_range[0]
+    x_y = color.rgb2y((x.float() - nmin)/nrange)
+    y_y = color.rgb2y((y.float() - nmin)/nrange)
+    return psnr(x_y, y_y, 1.0)
+
+_windows = {}
+
+def _gaussian_window(channels: int, device, size: int=11, sigma: float=1.5):
+    key = (channels, str(device))
+    if not key in _windows:
+        g = torch.arange(size, dtype=torch.float32) - (size - 1)/2.0
+        g = torch.exp(-g**2/(2*sigma**2))
+        g = g/g.sum()
+        window = (g.view(-1,1)*g.view(1,-1)).expand(channels,1,size,size)
+        _windows[key] = window.contiguous().to(device)
+    return _windows[key]
+
+def ssim(x: torch.Tensor, y: torch.Tensor,
+         norm_range: List[float]) -> torch.Tensor:
+    """ Structural similarity index (Wang et al. 2004, gaussian window of
+    size 11 and sigma 1.5) of every sample of the normalized batches x and
+    y, averaged over channels and pixels. """
+    nmin, nrange = norm_range[0], norm_range[1] - norm_range[0]
+    x, y = (x.float() - nmin)/nrange, (y.float() - nmin)/nrange
+    c = x.shape[1]
+    window = _gaussian_window(c, x.device)
+    c1, c2 = 0.01**2, 0.03**2
+    def _filter(z):
+        return torch.nn.functional.conv2d(z, window, groups=c)
+    mu_x, mu_y = _filter(x), _filter(y)
+    sigma_xx = _filter(x*x) - mu_x*mu_x
+    sigma_yy = _filter(y*y) - mu_y*mu_y
+    sigma_xy = _filter(x*y) - mu_x*mu_y
+    ssim_map = ((2*mu_x*mu_y + c1)*(2*sigma_xy + c2)) / \
+               ((mu_x*mu_x + mu_y*mu_y + c1)*(sigma_xx + sigma_yy + c2))
+    return ssim_map.view(x.shape[0], -1).mean(dim=1)
+
+# =============================================================================
+# Aggregation.
+# =============================================================================
+class _Metrics_(object):
+    """ Streaming aggregation of per-sample metrics of a dataset. The values
+    are stored in (preallocated) buffers on the device of the metrics and
+    only transferred to the host once, when summarized. """
+
+    percentiles = [10, 50, 90]
+
+    def __init__(self, num_samples: int):
+        self.num_samples = num_samples
+        self.values = {}
+        self.counts = {}
+
+    def update(self, name: str, values: torch.Tensor):
+        """ Add metric values (b,) of a batch. """
+        if not name in self.values:
+            self.values[name] = torch.zeros(self.num_samples,
+                                            device=values.device)
+            self.counts[name] = 0
+        i, n = self.counts[name], values.numel()
+        self.values[name][i:i+n] = values.detach().float().view(-1)
+        self.counts[name] = i + n
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ Return mean, best (maximum) and percentiles of every metric. """
+        names, stats = list(self.values.keys()), []
+        for name in names:
+            x = self.values[name][:self.counts[name]]
+            x_sorted = x.sort()[0]
+            idx = [int(round(p/100.0*(len(x) - 1))) for p in self.percentiles]
+            stats.append(torch.cat([x.mean().view(1), x_sorted[-1:],
+                                    x_sorted[idx]]))
+        if len(stats) == 0: return {}
+        stats = torch.stack(stats).cpu().tolist()
+        keys = ["mean", "best"] + ["p{}".format(p) for p in self.percentiles]
+        return {n: dict(zip(keys, s)) for n, s in zip(names, stats)}
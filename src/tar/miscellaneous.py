@@ -6,18 +6,27 @@
 # =============================================================================
 import argparse
 import csv
-import glob
+import functools
+import hashlib
 import imageio
+import json
 import math
-from multiprocessing import Process, Queue
 import numpy as np
 import os
 import pandas as pd
+import queue
 import random
+import shutil
+import signal
 import sys
+import threading
 import time
 import torch
-from typing import Dict, List
+import torch.multiprocessing as mp
+import traceback
+from typing import Dict, List, Tuple
+
+import tar.color as color
 
 import matplotlib
 matplotlib.use('Agg')
@@ -35,6 +44,7 @@ class _Checkpoint_(object):
         # Building model directory based on name and time.
         now = time.strftime("%H_%M_%S_%d_%b", time.gmtime())
         tag = args.template + "_" + now
+        if not args.continue_from == "": tag = args.continue_from
         self.dir = os.path.join(os.environ['SR_PROJECT_OUTS_PATH'], tag)
         self.dir_load = None
         # If previous training/model should be loaded, build loading path
@@ -67,7 +77,8 @@ class _Checkpoint_(object):
             for key, value in self.args_load.items():
                 if key in ["data_train","data_valid","scales_train",
                            "scales_valid","valid_only","load","cpu",
-                           "no_augment", "resume"]: continue
+                           "no_augment", "resume", "valid_epochs",
+                           "valid_workers"]: continue
                 args.__dict__[key] = value
         # Reformat and set input arguments.
         args      = reformat_args(args)
@@ -81,7 +92,8 @@ class _Checkpoint_(object):
             os.makedirs(valid_path, exist_ok=True)
         # Create output directory for logging data and write config.
         open_type = 'a' if os.path.exists(self.get_path('log.txt')) else 'w'
-        self.log_file = open(self.get_path('log.txt'), open_type)
+        self.log_name = 'log.txt'
+        self.log_file = open(self.get_path(self.log_name), open_type)
         with open(self.get_path('config.txt'), open_type) as f:
             for arg in vars(args):
                 f.write('{}: {}\n'.format(arg, getattr(args, arg)))
@@ -90,6 +102,11 @@ class _Checkpoint_(object):
         self.log_datasets = build_log_list(args.data_valid, args.scales_valid)
         # Set number of logging threats.
         self.n_processes  = 8
+        self.writers      = None
+        self.plotter      = _Plotter_()
+        self.saver        = _Saver_()
+        self.objects      = set()
+        self.manifests    = {}
         self.iter_is_best = False
         self.ready        = True
         self.write_log("Building model module ...")
@@ -105,47 +122,110 @@ class _Checkpoint_(object):
     # Saving
     # =========================================================================
     def save(self, trainer, epoch: int):
-        trainer.model.save(self.get_path('model'),epoch,is_best=self.iter_is_best)
-        trainer.loss.save(self.dir)
-        trainer.loss.plot_loss(self.dir, epoch, scaling="linear")
-        trainer.loss.plot_loss(self.dir, epoch, scaling="logarithmic")
-        trainer.optimizer.save(self.dir)
-        torch.save(self.log, self.get_path('psnr_log.pt'))
-        # Plot peak signal-to-noise ratio (PSNR) plot.
+        """ Save model (latest, best and epoch version), optimizer, loss and
+        psnr log. The states are copied to the cpu here, serialized in the
+        background (see _Saver_) and the plots are rendered by the plotting
+        process (see _Plotter_), so that training merely waits for the copy. """
+        trainer.loss.flush_log()
+        model_paths = trainer.model.save_paths(
+            self.get_path('model'), epoch, is_best=self.iter_is_best)
+        model_state = to_cpu(trainer.model.model.state_dict())
+        self.saver.put([
+            (model_state, model_paths),
+            (to_cpu(trainer.optimizer.state_dict()),
+             [self.get_path('optimizer.pth')]),
+            (to_cpu(trainer.loss.state_dict()), [self.get_path('loss.pt')]),
+            (trainer.loss.log.clone(), [self.get_path('loss_log.pt')]),
+            (self.log.clone(), [self.get_path('psnr_log.pt')])
+        ])
+        if trainer.model.archive is not None:
+            self.write_log(trainer.model.archive.summary())
+            self.saver.call(trainer.model.archive.save,
+                            self.get_path('model'), model_state, epoch)
+        # Plot loss and peak signal-to-noise ratio (PSNR) plots.
+        descs = [l["desc"] for l in trainer.loss.loss]
+        for scaling in ["linear", "logarithmic"]:
+            self.plotter.put(plot_loss, self.dir, descs,
+                             trainer.loss.log.numpy().copy(), epoch, 1e3, scaling)
         if self.log.shape[1] != len(self.log_datasets): return
-        axis = np.linspace(1, epoch, epoch)
         labels = trainer.log_description()
         for id, d in enumerate(self.log_datasets):
-            fig = plt.figure()
-            label = "PSNR on {}".format(d)
-            plt.title(label)
-            axes = plt.gca()
-            ymin, ymax = 0, 100
-            #axes.set_ylim([0,ymax])
-            for i in range(len(labels)):
-                log = torch.clamp(self.log[:, id, i], ymin+1, ymax-1)
-                plt.plot(axis,log.numpy(),label="{}".format(labels[i]))
-            plt.legend()
-            plt.xlabel('Epochs')
-            plt.ylabel('PSNR')
-            plt.grid(True)
-            plt.savefig(self.get_path("psnr_{}.pdf".format(d)))
-            plt.close(fig)
+            self.plotter.put(plot_psnr, self.get_path("psnr_{}.pdf".format(d)),
+                             "PSNR on {}".format(d), labels,
+                             self.log[:, id].numpy().copy(), epoch)
+
+    def save_snapshot(self, trainer, cursor: dict=None):
+        """ Save the complete training state atomically (write to temporary
+        file and rename it), i.e. model, optimizer and scheduler, gradient
+        scaler (float16), loss and psnr logs, random states and the cursor of
+        the interrupted epoch (None if the epoch has been completed). """
+        self.saver.join()
+        trainer.loss.flush_log()
+        state = {
+            "model": trainer.model.model.state_dict(),
+            "optimizer": trainer.optimizer.state_dict(),
+            "scheduler": trainer.optimizer.scheduler.state_dict(),
+            "loss_log": trainer.loss.log,
+            "psnr_log": self.log,
+            "valid_iter": trainer.valid_iter,
+            "error_last": trainer.error_last,
+            "rng": get_rng_states(),
+            "cursor": cursor
+        }
+        if trainer.scaler is not None:
+            state["scaler"] = trainer.scaler.state_dict()
+        path = self.get_path("snapshot.pt")
+        torch.save(state, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def load_snapshot(self, trainer):
+        """ Restore training state from snapshot (if existing) and return the
+        cursor of the interrupted epoch. """
+        path = self.get_path("snapshot.pt")
+        if not os.path.isfile(path): return None
+        kwargs = {'map_location': lambda storage, loc: storage}
+        state = torch.load(path, **kwargs)
+        trainer.model.model.load_state_dict(state["model"])
+        trainer.optimizer.load_state_dict(state["optimizer"])
+        trainer.optimizer.scheduler.load_state_dict(state["scheduler"])
+        trainer.loss.log = state["loss_log"]
+        self.log = state["psnr_log"]
+        trainer.valid_iter = state["valid_iter"]
+        trainer.error_last = state["error_last"]
+        set_rng_states(state["rng"])
+        if trainer.scaler is not None and "scaler" in state:
+            trainer.scaler.load_state_dict(state["scaler"])
+        self.write_log("... continue from snapshot {}".format(path))
+        return state["cursor"]
 
     def save_results(self, save_list: List[torch.Tensor], desc_list: List[str],
                      filename: str, dataset, scale: int):
-        filename = self.get_path(
-            'results_{}'.format(dataset.dataset.name),
-            '{}_x{}_'.format(filename, scale)
-        )
+        """ Save results content-addressed as objects/<sha1>.png, so that
+        unchanged images (e.g. the ground-truth) are written once per run.
+        The names <filename>_x<scale>_<desc>.png link to the latest result
+        and are recorded in the manifest of the iteration (begin_results). """
+        directory = self.get_path('results_{}'.format(dataset.dataset.name))
+        filename = '{}_x{}_'.format(filename, scale)
         assert len(save_list) == len(desc_list)
         for v, p in zip(save_list, desc_list):
-            normalized = v[0]
+            normalized = v[0].float()
             r = 255/(self.args.norm_max - self.args.norm_min)
             normalized = normalized.add(-self.args.norm_min).mul(r)
             normalized = normalized.clamp(0, 255).round()
             tensor_cpu = normalized.byte().permute(1, 2, 0).cpu()
-            self.queue.put(('{}{}.png'.format(filename, p), tensor_cpu))
+            digest = hashlib.sha1(tensor_cpu.numpy().tobytes())
+            digest.update(str(tuple(tensor_cpu.shape)).encode())
+            obj = os.path.join("objects", digest.hexdigest() + ".png")
+            obj_path = os.path.join(directory, obj)
+            if not obj_path in self.objects and not os.path.exists(obj_path):
+                self.writers.put(obj_path, tensor_cpu)
+            self.objects.add(obj_path)
+            name = '{}{}.png'.format(filename, p)
+            self.manifests[directory]["files"][name] = obj
+            link = os.path.join(directory, name)
+            if os.path.lexists(link + ".tmp"): os.remove(link + ".tmp")
+            os.symlink(obj, link + ".tmp")
+            os.replace(link + ".tmp", link)
 
     def save_pertubation(self, eps, psnrs, labels):
         """ Save perturbation array (dataset, eps) as dataframe. """
@@ -173,10 +253,57 @@ class _Checkpoint_(object):
         plt.savefig(self.get_path("runtime.pdf"))
         plt.close(fig)
 
-    def clear_results(self, dataset):
+    def save_benchmark(self, report: dict):
+        """ Save benchmark report (see benchmark._Benchmark_) as json. """
+        if len(report["records"]) == 0: return
+        with open(self.get_path("benchmark.json"), "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    def begin_results(self, dataset, iteration: int):
+        """ Begin manifest of the results of the dataset in the iteration,
+        written in end_background. """
         directory = self.get_path("results_{}".format(dataset.dataset.name))
-        files = glob.glob(directory + "/*.png")
-        for f in files: os.remove(f)
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.manifests.setdefault(directory, {"iteration": iteration,
+                                              "files": {}})
+
+    def save_manifests(self):
+        """ Write the manifests of the iteration (also as manifest_best.json
+        if it is the best iteration so far) and prune the results. """
+        for directory, manifest in self.manifests.items():
+            name = "manifest_{:03d}.json".format(manifest["iteration"])
+            names = [name]
+            if self.iter_is_best: names.append("manifest_best.json")
+            for n in names:
+                with open(os.path.join(directory, n + ".tmp"), "w") as f:
+                    json.dump(manifest["files"], f, indent=2, sort_keys=True)
+                os.replace(os.path.join(directory, n + ".tmp"),
+                           os.path.join(directory, n))
+            self.prune_results(directory, keep=[name, "manifest_best.json"])
+        self.manifests = {}
+
+    def prune_results(self, directory: str, keep: List[str]):
+        """ Remove all manifests in the results directory except of the kept
+        ones (latest and best iteration) and all objects which are neither
+        referenced by them nor by the result links. Must be called after all
+        queued results have been written (see end_background). """
+        referenced = set()
+        for entry in os.scandir(directory):
+            name = entry.name
+            if name.startswith("manifest_") and name.endswith(".json"):
+                if not name in keep:
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path) as f:
+                    referenced.update(json.load(f).values())
+            elif entry.is_symlink():
+                referenced.add(os.readlink(entry.path))
+        referenced = set([os.path.join(directory, x) for x in referenced])
+        for entry in os.scandir(os.path.join(directory, "objects")):
+            if not entry.path in referenced: os.remove(entry.path)
+        self.objects = set([x for x in self.objects
+                            if not x.startswith(directory + os.sep)])
+        self.objects.update(referenced)
 
     def save_validations(self, valids: List[Dict[str,str]]):
         file_path = self.get_path('validations.csv')
@@ -199,36 +326,38 @@ class _Checkpoint_(object):
         self.log_file.write(log + '\n')
         if refresh:
             self.log_file.close()
-            self.log_file = open(self.get_path('log.txt'), 'a')
+            self.log_file = open(self.get_path(self.log_name), 'a')
         if self.args.verbose: print(log)
 
+    def redirect_log(self, name: str):
+        """ Continue logging to another file, e.g. in forked processes which
+        would otherwise interleave their lines in the shared log file. """
+        self.log_file.close()
+        self.log_name = name
+        self.log_file = open(self.get_path(self.log_name), 'a')
+
     def done(self):
         self.ready = False
         self.log_file.close()
+        if self.writers is not None: self.writers.shutdown()
+        self.writers = None
+        self.saver.shutdown()
+        self.plotter.shutdown()
 
     # =========================================================================
     # Multithreading.
     # =========================================================================
     def begin_background(self):
-        self.queue = Queue()
-
-        def bg_target(queue):
-            while True:
-                if not queue.empty():
-                    filename, tensor = queue.get()
-                    if filename is None: break
-                    imageio.imwrite(filename, tensor.numpy())
-
-        self.process = [
-            Process(target=bg_target, args=(self.queue,)) \
-            for _ in range(self.n_processes)
-        ]
-        for p in self.process: p.start()
+        """ Start the result writer pool (once per run, see _WriterPool_). """
+        if self.writers is None:
+            self.writers = _WriterPool_(self.n_processes,
+                                        self.args.png_compression)
 
     def end_background(self):
-        for _ in range(self.n_processes): self.queue.put((None, None))
-        while not self.queue.empty(): time.sleep(1)
-        for p in self.process: p.join()
+        """ Wait until all queued results have been written and save the
+        manifests of the results. """
+        if self.writers is not None: self.writers.join()
+        self.save_manifests()
 
     def get_path(self, *subdir):
         return os.path.join(self.dir, *subdir)
@@ -239,6 +368,179 @@ class _Checkpoint_(object):
 # =============================================================================
 # Timer class.
 # =============================================================================
+def to_cpu(obj):
+    """ Copy the (nested) tensors of obj, e.g. a state dict, to the cpu,
+    independent from later in-place updates of the original tensors. """
+    if torch.is_tensor(obj):
+        return obj.detach().cpu() if obj.is_cuda else obj.detach().clone()
+    if isinstance(obj, dict):
+        copy = type(obj)((k, to_cpu(v)) for k, v in obj.items())
+        if hasattr(obj, "_metadata"): copy._metadata = obj._metadata
+        return copy
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+def plot_loss(directory: str, descs: List[str], log: np.ndarray, epoch: int,
+              threshold: float=1e3, scaling: str="linear"):
+    """ Plot loss curves of every loss function (log: epochs x losses) and
+    store the resulting figure in given directory. To avoid badly scaled
+    loss plots the values are thresholded, i.e. every loss above the
+    threshold value is set to the threshold value.
+    Loss axis either in "logarithmic" or "linear" scale. """
+    axis = np.linspace(1, epoch, epoch)
+    for i, label in enumerate(descs):
+        fig = plt.figure()
+        plt.title(label)
+        losses = log[:, i].copy()
+        losses[losses > threshold] = threshold
+        if scaling == "linear":
+            pass
+        elif scaling == "logarithmic":
+            losses = [np.log10(x) for x in losses]
+        else:
+            raise ValueError("Invalid loss plot scaling {}".format(scaling))
+        plt.plot(axis, losses, label=label)
+        plt.legend()
+        plt.xlabel("Epochs")
+        plt.ylabel("Loss - {}".format(scaling.capitalize()))
+        plt.grid(True)
+        plt.savefig(directory + "/loss_{}_{}.pdf".format(label,scaling))
+        plt.close(fig)
+
+def plot_psnr(path: str, title: str, labels: List[str], log: np.ndarray,
+              epoch: int):
+    """ Plot PSNR curves (log: epochs x labels) and store figure in path. """
+    axis = np.linspace(1, epoch, epoch)
+    fig = plt.figure()
+    plt.title(title)
+    ymin, ymax = 0, 100
+    for i in range(len(labels)):
+        plt.plot(axis, np.clip(log[:, i], ymin+1, ymax-1),
+                 label="{}".format(labels[i]))
+    plt.legend()
+    plt.xlabel('Epochs')
+    plt.ylabel('PSNR')
+    plt.grid(True)
+    plt.savefig(path)
+    plt.close(fig)
+
+class _Saver_(object):
+    """ Background thread serializing (cpu) objects. Every object is
+    serialized once, atomically (temporary file and rename), and hard-linked
+    (or copied) to its further paths. The queue holds a single job, so that
+    putting a job blocks while the previous one is written. """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def put(self, jobs: List[Tuple[object, List[str]]]):
+        """ Save every object of the jobs under its paths. """
+        self.queue.put(functools.partial(self._save_all, jobs))
+
+    def call(self, fn, *args):
+        """ Call fn(*args) in the background (e.g. a custom save). """
+        self.queue.put(functools.partial(fn, *args))
+
+    def join(self):
+        self.queue.join()
+
+    def shutdown(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _loop(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None: break
+                task()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    @classmethod
+    def _save_all(cls, jobs: List[Tuple[object, List[str]]]):
+        for obj, paths in jobs: cls._save(obj, paths)
+
+    @staticmethod
+    def _save(obj, paths: List[str]):
+        torch.save(obj, paths[0] + ".tmp")
+        os.replace(paths[0] + ".tmp", paths[0])
+        for path in paths[1:]:
+            if os.path.exists(path + ".tmp"): os.remove(path + ".tmp")
+            try:
+                os.link(paths[0], path + ".tmp")
+            except OSError:
+                shutil.copyfile(paths[0], path + ".tmp")
+            os.replace(path + ".tmp", path)
+
+def _plot_loop(tasks):
+    while True:
+        item = tasks.get()
+        if item is None: break
+        fn, args = item
+        try:
+            fn(*args)
+        except Exception:
+            traceback.print_exc()
+
+class _Plotter_(object):
+    """ Process rendering plots (matplotlib), i.e. calling the enqueued
+    plotting functions with their (numpy) data. The process is forked at
+    construction, i.e. before the main process initializes cuda. """
+
+    def __init__(self):
+        self.queue = mp.Queue()
+        self.process = mp.Process(target=_plot_loop, args=(self.queue,),
+                                  daemon=True)
+        self.process.start()
+
+    def put(self, fn, *args):
+        self.queue.put((fn, args))
+
+    def shutdown(self):
+        self.queue.put(None)
+        self.process.join()
+
+def _writer_loop(tasks, compression: int):
+    reset_snapshot_signals()
+    while True:
+        filename, tensor = tasks.get()
+        try:
+            if filename is None: break
+            imageio.imwrite(filename, tensor.numpy(), compression=compression)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            tasks.task_done()
+
+class _WriterPool_(object):
+    """ Long-lived pool of processes writing uint8 images (h,w,c) to png
+    files. Images are passed through a bounded queue in shared memory, so
+    putting an image blocks while all writers are busy (back-pressure) and
+    idle writers block on the queue instead of polling it. """
+
+    def __init__(self, num_workers: int, compression: int):
+        self.queue = mp.JoinableQueue(maxsize=4*num_workers)
+        self.process = [mp.Process(target=_writer_loop, daemon=True,
+                                   args=(self.queue, compression))
+                        for _ in range(num_workers)]
+        for p in self.process: p.start()
+
+    def put(self, filename: str, tensor: torch.Tensor):
+        self.queue.put((filename, tensor.share_memory_()))
+
+    def join(self):
+        self.queue.join()
+
+    def shutdown(self):
+        for _ in self.process: self.queue.put((None, None))
+        for p in self.process: p.join()
+
 class _Timer_(object):
     """ Time logging class based on time library. """
 
@@ -296,8 +598,9 @@ def calc_psnr(x: torch.Tensor, y: torch.Tensor,
     https://www.mathworks.com/help/vision/ref/psnr.html. If patch size
     is None the PSNR will be determined over the full tensors, otherwise
     a random patch of give patch size is determined and the PSNR is calculated
-    with respect to this patch. The tensors have an expected shape of (b,c,h,w). """
-    mse = torch.pow(x - y, 2).mean().item()
+    with respect to this patch. The tensors have an expected shape of (b,c,h,w).
+    The PSNR is always determined in float32 precision. """
+    mse = torch.pow(x.float() - y.float(), 2).mean().item()
     # if patch_size is not None:
     #     h, w = x.shape[2:4]
     #     lp = int(patch_size)
@@ -311,9 +614,10 @@ def calc_psnr(x: torch.Tensor, y: torch.Tensor,
 
 def discretize(img: torch.Tensor, norm_range: List[float]) -> torch.Tensor:
     """ Discretize image (given as torch tensor) in defined range of
-    pixel values (e.g. 255 or 1.0), i.e. smart rounding. """
+    pixel values (e.g. 255 or 1.0), i.e. smart rounding. The image is
+    discretized in float32 precision (also in autocast mode). """
     pixel_range = 255 * (norm_range[1] - norm_range[0])
-    img_dis = img.add(-norm_range[0]) # denormalization
+    img_dis = img.float().add(-norm_range[0]) # denormalization
     img_dis = img_dis.mul(pixel_range).clamp(0, 255).round().div(pixel_range)
     img_dis = img_dis.add(norm_range[0]) # normalization
     return img_dis
@@ -332,6 +636,76 @@ def unnormalize(img, norm_min, norm_max):
     norm_range = norm_max - norm_min
     return (img - norm_min)/norm_range*255.0
 
+def augment(tensors: List[torch.Tensor]) -> List[torch.Tensor]:
+    """ Randomly flip (horizontally and vertically) and transpose every
+    sample of batched tensors (b,c,h,w) on their device. The random choice
+    is drawn per sample but shared by all tensors, so that e.g. LR and HR
+    patch of a sample are augmented identically. Transposing is only
+    applied if all tensors are square. """
+    b, device = tensors[0].shape[0], tensors[0].device
+    masks = torch.rand(3, b, 1, 1, 1, device=device) < 0.5
+    square = all([x.shape[2] == x.shape[3] for x in tensors])
+    def _augment_x(x):
+        x = torch.where(masks[0], x.flip(3), x)
+        x = torch.where(masks[1], x.flip(2), x)
+        if square: x = torch.where(masks[2], x.transpose(2, 3), x)
+        return x
+    return [_augment_x(x) for x in tensors]
+
+_downscale_kernels = {}
+
+def downscale_kernel(scale: int):
+    """ Build separable 1D kernel (and padding) of the anti-aliased bicubic
+    downscaling used by src/datasets/downsample.py, i.e. skimage's rescale
+    with anti_aliasing=True, mode='reflect' and order=4: gaussian smoothing
+    (sigma = (scale-1)/2, truncated at 4 sigma) followed by order-4 spline
+    interpolation at the centers of the scale x scale pixel blocks. Both
+    steps are linear and shift-invariant, so the kernel is obtained once
+    as impulse response of the scipy implementation. """
+    if scale in _downscale_kernels: return _downscale_kernels[scale]
+    import scipy.ndimage as ndi
+    sigma = (scale - 1)/2.0
+    pad = int(4*sigma + 0.5) + 12 # gaussian support + decay of spline filter
+    n = 4*pad + 2*scale + 1
+    impulse = np.zeros(n)
+    impulse[n//2] = 1.0
+    if sigma > 0:
+        impulse = ndi.gaussian_filter1d(impulse,sigma,mode="mirror",truncate=4.0)
+    # Tap k is applied to input pixel scale*i + k - pad of output pixel i,
+    # whose center lies at scale*i + (scale-1)/2 in the input.
+    t = (scale - 1)/2.0 + pad - np.arange(2*pad + scale)
+    kernel = ndi.map_coordinates(impulse, [n//2 + t], order=4, mode="mirror")
+    _downscale_kernels[scale] = (kernel.astype(np.float32), pad)
+    return _downscale_kernels[scale]
+
+def downscale(img: torch.Tensor, scale: int, pads: List[int]=None) -> torch.Tensor:
+    """ Downscale batch of images (b,c,h,w) by integer scale factor (h and
+    w have to be multiples of scale) using the anti-aliased bicubic kernel
+    (see downscale_kernel) in two strided convolutions. The images are
+    reflected at their borders by the kernel's padding, unless other paddings
+    (left, right, top, bottom) are given, e.g. if the image is a region cut
+    with margin from a larger image. """
+    kernel, pad = downscale_kernel(scale)
+    if pads is None: pads = [pad]*4
+    kernel = torch.from_numpy(kernel).to(img.device)
+    b, c, h, w = img.shape
+    x = img.contiguous().view(b*c, 1, h, w)
+    if any([p > 0 for p in pads]):
+        x = torch.nn.functional.pad(x, tuple(pads), mode="reflect")
+    x = torch.nn.functional.conv2d(x, kernel.view(1,1,1,-1), stride=(1,scale))
+    x = torch.nn.functional.conv2d(x, kernel.view(1,1,-1,1), stride=(scale,1))
+    return x.view(b, c, x.shape[2], x.shape[3])
+
+def entcolorize(col: torch.Tensor, colorspace: str) -> torch.Tensor:
+    """ Build grey input image (b,1,h,w) from batch of normalized color
+    images (b,3,h,w) on their device, equivalent to the per sample skimage
+    conversion (rgb2ycbcr Y-channel, rgb2hsv hue or rgb2gray) divided
+    by 255 formerly done in the dataloader. """
+    if colorspace == "ycbcr":  return color.rgb2y(col)
+    elif colorspace == "hsv":  return color.rgb2hue(col)/255.0
+    elif colorspace == "gray": return color.rgb2gray(col)/255.0
+    else: raise ValueError("Undefined colorspace {} !".format(colorspace))
+
 def is_power2(num):
     return num != 0 and ((num & (num - 1)) == 0)
 
@@ -351,6 +725,29 @@ def build_log_list(datasets, scales):
             log_list.append(dv + "x" + str(sv))
     return log_list
 
+snapshot_signals = [signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2]
+
+def reset_snapshot_signals():
+    """ Restore the default handlers of the snapshot signals (see _Trainer_.
+    request_snapshot) in forked worker processes, which otherwise inherit
+    the handler and ignore SIGTERM (multiprocessing terminates its daemon
+    children with SIGTERM at exit and joins them). """
+    for s in snapshot_signals: signal.signal(s, signal.SIG_DFL)
+
+def get_rng_states() -> dict:
+    states = {"random": random.getstate(), "numpy": np.random.get_state(),
+              "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+def set_rng_states(states: dict):
+    random.setstate(states["random"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+
 def reformat_args(args):
     def reformat_to_list(inputs):
         if type(inputs) == list: return inputs
@@ -367,8 +764,19 @@ def reformat_args(args):
     args.scales_guidance = reformat_to_list(args.scales_guidance)
     args.scales_valid = reformat_to_list(args.scales_valid)
     args.betas = reformat_to_list(args.betas)
+    args.bench_threads = reformat_to_list(args.bench_threads)
+    args.bench_batch_sizes = reformat_to_list(args.bench_batch_sizes)
+    if type(args.valid_epochs) == str:
+        args.valid_epochs = reformat_to_list(args.valid_epochs) \
+                            if args.valid_epochs else []
     args.data_valid = args.data_valid.split(":")
     args.data_train = args.data_train.split(":")
+    if type(args.data_weights) == str:
+        # Either given as 1:2 or as list [1.0, 2.0] (loaded config).
+        weights = args.data_weights
+        if weights.startswith("["): weights = weights[1:-1].replace(",", ":")
+        weights = weights.split(":") if weights else []
+        args.data_weights = [float(x) for x in weights]
     #args.data_valid.append(args.data_train)
     for arg in vars(args):
         if vars(args)[arg] == "True":
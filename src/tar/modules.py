@@ -7,11 +7,13 @@
 from abc import abstractmethod
 import argparse
 import importlib
+from typing import List
 
 import torch
 from torch import nn
 import torch.utils.model_zoo
 
+import tar.archive as archive
 import tar.miscellaneous as misc
 
 class _Model_(nn.Module):
@@ -27,6 +29,9 @@ class _Model_(nn.Module):
         self.device = torch.device('cpu' if args.cpu else args.cuda_device)
         self.n_gpus = args.n_gpus
         self.save_models = args.save_models
+        self.archive = None
+        if self.save_models and args.archive_keyframe > 0:
+            self.archive = archive._EpochArchive_(args.archive_keyframe)
         module = importlib.import_module('tar.models.' + args.model.lower())
         self.model = module.build_net().to(self.device)
         # If model should be loaded from another training, check first whether
@@ -55,21 +60,22 @@ class _Model_(nn.Module):
     # =========================================================================
     # Saving and Loading
     # =========================================================================
-    def save(self, directory: str, epoch: int, is_best: bool=False):
-        """ Save model as latest version, as epoch version and (if is_best flag
-        is set to True) as best version. """
+    def save_paths(self, directory: str, epoch: int,
+                   is_best: bool=False) -> List[str]:
+        """ Paths to save the model state to (see _Checkpoint_.save), the
+        latest version, the epoch version (unless stored in the epoch
+        archive) and (if is_best flag is set to True) the best version. """
         save_dirs = [directory + "/model_latest.pt"]
         if is_best:
             save_dirs.append(directory + "/model_best.pt")
-        if self.save_models:
+        if self.save_models and self.archive is None:
             save_dirs.append(directory + "/model_{}.pt".format(epoch))
-        # Save model under given paths.
-        for s in save_dirs:
-            torch.save(self.model.state_dict(), s)
+        return save_dirs
 
     def load(self, directory: str, resume: int=-1, cpu: bool=False):
         """ Load model from directory, either the latest version (resume = -1)
-        or from a specific epoch (resume = epoch) to device. """
+        or from a specific epoch (resume = epoch, full or from the epoch
+        archive, see archive.load) to device. """
         load_from = None
         kwargs = {'map_location': lambda storage, loc: storage} if cpu else {}
         path = ""
@@ -79,7 +85,8 @@ class _Model_(nn.Module):
             path = directory + "/model_best.pt"
         else:
             path = directory + "/model_{}.pt".format(resume)
-        load_from = torch.load(path, **kwargs)
+            load_from = archive.load(directory, resume)
+        if load_from is None: load_from = torch.load(path, **kwargs)
         self.model.load_state_dict(load_from, strict=False)
         return path
 
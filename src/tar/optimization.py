@@ -5,11 +5,6 @@
 # Description : Optimization and Loss implementations.
 # =============================================================================
 import argparse
-import numpy as np
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
 import torch
 from torch import nn
@@ -101,6 +96,7 @@ class _Loss_(nn.modules.loss._Loss):
             self.loss.append({
                 "weight"    : float(weight),
                 "desc"      : "{}-{}".format(input_type, loss_type),
+                "input"     : input_type,
                 "cut"       : cut,
                 "function"  : loss_function})
             self.loss_module.append(loss_function)
@@ -119,27 +115,31 @@ class _Loss_(nn.modules.loss._Loss):
             )
         # Auxialiary variables.
         self.pixel_range = args.norm_max - args.norm_min
-        # Build logging and load previous log (if required).
+        # Build logging and load previous log (if required). Losses are
+        # accumulated on the device and only added to the log when it is
+        # read (see flush_log).
         self.log = torch.Tensor()
+        self.log_acc = None
         ckp.write_log("... successfully built loss module !")
 
     def forward(self, kwargs):
         """ Given the required input arguments determine every single
-        loss as well as the total loss, return and add to logging. """
+        loss as well as the total loss, return and add to logging. The
+        losses are logged without synchronizing with the device. """
         # Determine loss given loss function.
         losses = []
-        for i, l in enumerate(self.loss):
-            input_type = l["desc"].split("-")[0]
-            if l["function"] is not None:
-                x, y = kwargs[input_type+"_OUT"], kwargs[input_type+"_GT"]
-                loss = l["function"](x, y)
-                loss_norm = torch.div(loss,self.pixel_range*x.numel())*100
-                if loss_norm < l["cut"]: loss = torch.mul(loss,0.0)
-                effective_loss = l["weight"] * loss
-                losses.append(effective_loss)
-                self.log[-1, i] += effective_loss.item()
+        for l in self.loss:
+            if l["function"] is None: continue
+            x, y = kwargs[l["input"]+"_OUT"], kwargs[l["input"]+"_GT"]
+            loss = l["function"](x, y)
+            # Losses below the cut threshold are set to zero.
+            loss_norm = torch.div(loss,self.pixel_range*x.numel())*100
+            loss = torch.where(loss_norm < l["cut"], torch.zeros_like(loss), loss)
+            losses.append(l["weight"] * loss)
         loss_sum = sum(losses)
-        self.log[-1, -1] += loss_sum.item()
+        log = torch.stack([x.detach().float() for x in losses + [loss_sum]])
+        if self.log_acc is None: self.log_acc = log
+        else: self.log_acc.add_(log)
         return loss_sum
 
     # =========================================================================
@@ -148,7 +148,7 @@ class _Loss_(nn.modules.loss._Loss):
     def save(self, directory: str):
         """ Save internal state and logging in given directory. """
         torch.save(self.state_dict(), directory + "/loss.pt")
-        torch.save(self.log, directory + "/loss.pt")
+        torch.save(self.log, directory + "/loss_log.pt")
 
     def load(self, directory: str, cpu: bool=False):
         """ Load internal state and logging from given directory and redo
@@ -161,14 +161,23 @@ class _Loss_(nn.modules.loss._Loss):
     # Logging, plotting, displaying
     # =========================================================================
     def start_log(self):
+        self.flush_log()
         self.log = torch.cat((self.log, torch.zeros(1, len(self.loss))))
 
     def end_log(self, n_batches: int):
+        self.flush_log()
         self.log[-1].div_(n_batches)
 
+    def flush_log(self):
+        """ Add the losses accumulated on the device to the log. """
+        if self.log_acc is None: return
+        self.log[-1] += self.log_acc.cpu()
+        self.log_acc = None
+
     def display_loss(self, batch: int) -> str:
         """ Build loss description string containing a list of all losses
         and their according normalized tensor. """
+        self.flush_log()
         n_samples = batch + 1
         log = []
         for l, c in zip(self.loss, self.log[-1]):
@@ -176,35 +185,17 @@ class _Loss_(nn.modules.loss._Loss):
         return "".join(log)
 
     def get_total_loss(self) -> float:
+        self.flush_log()
         return self.log[-1, -1]
 
     def plot_loss(self, directory: str, epoch: int,
                   threshold: float=1e3, scaling: str="linear"):
         """ Plot loss curves of every internal loss function and store
-        the resulting figure in given directory. To avoid badly scaled
-        loss plots the values are thresholded, i.e. every loss above the
-        threshold value is set to the threshold value.
-        Loss axis either in "logarithmic" or "linear" scale. """
-        axis = np.linspace(1, epoch, epoch)
-        for i, l in enumerate(self.loss):
-            label = l["desc"]
-            fig = plt.figure()
-            plt.title(label)
-            losses = self.log[:, i].numpy()
-            losses[losses > threshold] = threshold
-            if scaling == "linear":
-                pass
-            elif scaling == "logarithmic":
-                losses = [np.log10(x) for x in losses]
-            else:
-                raise ValueError("Invalid loss plot scaling {}".format(scaling))
-            plt.plot(axis, losses, label=label)
-            plt.legend()
-            plt.xlabel("Epochs")
-            plt.ylabel("Loss - {}".format(scaling.capitalize()))
-            plt.grid(True)
-            plt.savefig(directory + "/loss_{}_{}.pdf".format(l['desc'],scaling))
-            plt.close(fig)
+        the resulting figure in given directory (see plot_loss). """
+        self.flush_log()
+        descs = [l["desc"] for l in self.loss]
+        misc.plot_loss(directory, descs, self.log.numpy(), epoch,
+                       threshold, scaling)
 
     def get_loss_module(self) -> nn.ModuleList:
         """ Return loss modules (depending on number of gpus they are either
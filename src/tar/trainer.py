@@ -5,16 +5,21 @@
 # Description : Model training and validation class.
 # =============================================================================
 import argparse
+import contextlib
 import os
 import importlib
 import math
 import numpy as np
 import random
-from typing import List, Tuple
+import signal
+import sys
+from typing import Dict, List, Tuple
 
 import torch
 
+import tar.benchmark as tar_benchmark
 import tar.dataloader as dataloader
+import tar.metrics as tar_metrics
 import tar.miscellaneous as misc
 import tar.modules as modules
 import tar.optimization as optimization
@@ -34,6 +39,7 @@ class _Trainer_(object):
         self.ckp = ckp
         self.loader_train = loader.loader_train
         self.loader_valid = loader.loader_valid
+        self.loader_valid_multi = loader.loader_valid_multi
         self.check_datasets()
         self.model = model
         self.loss = loss
@@ -42,6 +48,32 @@ class _Trainer_(object):
         self.valid_iter = 1
         self.device = torch.device('cpu' if self.args.cpu else self.args.cuda_device)
         self.ckp.write_log("Building trainer module ...")
+        # Reduced precision (autocast) and gradient scaling for float16 on
+        # cuda devices (bfloat16 has the float32 range).
+        self.precision = None
+        if not self.args.precision == "float32":
+            if not hasattr(torch, "autocast"):
+                raise ValueError("Precision {} requires autocast (torch>=1.10) !".format(
+                                 self.args.precision))
+            if self.args.precision == "float16" and self.device.type != "cuda":
+                raise ValueError("Precision float16 requires a cuda device !")
+            self.precision = getattr(torch, self.args.precision)
+        self.benchmark = tar_benchmark._Benchmark_(self.device,
+            self.args.bench_warmup, self.args.bench_repeats,
+            self.args.bench_threads, self.args.bench_batch_sizes)
+        self.scaler = None
+        if self.precision == torch.float16 and self.device.type == "cuda":
+            self.scaler = torch.cuda.amp.GradScaler()
+        # Continue interrupted training from snapshot (if existing) and take
+        # snapshots periodically or when signaled (e.g. before job is killed).
+        self.resume = None
+        self.snapshot_signal = None
+        self.timer_snapshot = misc._Timer_()
+        if not self.args.valid_only:
+            if not self.args.continue_from == "":
+                self.resume = self.ckp.load_snapshot(self)
+            for s in misc.snapshot_signals:
+                signal.signal(s, self.request_snapshot)
 
     # =========================================================================
     # Training
@@ -49,8 +81,10 @@ class _Trainer_(object):
     def train(self):
         """ Training function for one epoch. Automated logging, using
         optimizer and loss stated in the __init__ (their state is loaded
-        and updated automatically). """
-        self.optimizer.schedule()
+        and updated automatically). An epoch interrupted by a snapshot is
+        continued from the snapshot's cursor. """
+        resume, self.resume = self.resume, None
+        if resume is None: self.optimizer.schedule()
         epoch = self.optimizer.get_last_epoch() + 1
         finetuning = epoch >= self.args.fine_tuning
         scale = self.scale_current(epoch)
@@ -59,25 +93,53 @@ class _Trainer_(object):
             "\n[Epoch {}]\tLearning rate: {}\tFinetuning: {}\t Scale: x{}".format(
             epoch, lr, finetuning, scale
         ))
-        self.loss.start_log()
+        if resume is None: self.loss.start_log()
         self.model.train()
+        # Training loaders are built when first training on the scale.
+        if not scale in self.loader_train:
+            timer_build = misc._Timer_()
+            self.loader_train[scale]
+            self.check_datasets()
+            self.ckp.write_log("Built loaders for x{} in {:.2f}s".format(
+                scale, timer_build.toc()
+            ))
         # Iterate over all batches in epoch.
         timer_data, timer_model = misc._Timer_(), misc._Timer_()
-        for d in self.loader_train[scale]:
+        for di, d in enumerate(self.loader_train[scale]):
+            start = 0
+            if resume is not None and di < resume["dataset"]: continue
+            if resume is not None and di == resume["dataset"]:
+                d.load_state_dict(resume["sampler"])
+                start = resume["sampler"]["position"]
             self.ckp.write_log("Training on dataset {}".format(d.dataset.name))
-            for batch, data in enumerate(d):
+            batches = d
+            if self.args.prefetch > 0:
+                batches = dataloader._Prefetcher_(d,self.device,self.args.prefetch)
+            timer_start = misc._Timer_()
+            for batch, data in enumerate(batches, start):
                 # Load images.
-                lr, hr = self.prepare(data)
+                lr, hr = self.prepare(data, augment=not self.args.no_augment)
+                if batch == start:
+                    self.ckp.write_log("First batch after {:.2f}s".format(
+                        timer_start.toc()
+                    ))
                 timer_data.hold()
                 timer_model.tic()
                 # Optimization core.
                 self.optimizer.zero_grad()
-                loss = self.optimization_core(lr, hr, finetuning, scale)
+                with self.autocast():
+                    loss = self.optimization_core(lr, hr, finetuning, scale)
+                if self.scaler is not None: loss = self.scaler.scale(loss)
                 loss.backward()
+                if self.scaler is not None: self.scaler.unscale_(self.optimizer)
                 if self.args.gclip > 0:
                     torch.nn.utils.clip_grad_value_(self.model.parameters(),
                                                     self.args.gclip)
-                self.optimizer.step()
+                if self.scaler is not None:
+                    self.scaler.step(self.optimizer)
+                    self.scaler.update()
+                else:
+                    self.optimizer.step()
                 timer_model.hold()
                 # Logging (if printable epoch).
                 if (batch + 1) % self.args.print_every == 0:
@@ -87,7 +149,12 @@ class _Trainer_(object):
                         self.loss.display_loss(batch),
                         timer_model.release(),
                         timer_data.release()))
+                # Snapshot (if requested or periodically).
+                if self.snapshot_due():
+                    self.snapshot({"dataset": di,
+                                   "sampler": d.state_dict(batch + 1)})
                 timer_data.tic()
+            self.log_cache_stats(d)
         # Finalizing - Save error and logging.
         self.loss.end_log(len(d.dataset))
         self.error_last = self.loss.log[-1, -1]
@@ -114,25 +181,22 @@ class _Trainer_(object):
         # measures such as PSNR, runtime, etc..
         if save: self.ckp.begin_background()
         timer_valid = misc._Timer_()
-        validations = []
+        validations = self.validate_datasets(save=save, finetuning=finetuning)
         for di, d in enumerate(self.loader_valid):
-            name, scale = d.dataset.name, d.dataset.scale
-            if save: self.ckp.clear_results(d)
-            self.ckp.write_log("{}x{}".format(name,scale))
-            v = {"dataset":"{}".format(name + " "*(10-len(name))),
-                 "scale": "x{}".format(scale)}
-            v = self.testing_core(v, d, di, save=save, finetuning=finetuning)
             best = self.save_psnr_checkpoint(d, di)
-            validations.append(v)
         # Determine average runtime.
-        if save and self.args.valid_only:
+        runtimes = [v for v in validations if "RUNTIME_AL" in v]
+        if save and self.args.valid_only and len(runtimes) > 0:
             self.ckp.write_log(
                 "Validation {} (runtime test) ...".format(self.valid_iter)
             )
-            runtime_al = np.mean([float(v["RUNTIME_AL"]) for v in validations])
-            runtime_up = np.mean([float(v["RUNTIME_UP"]) for v in validations])
-            runtime_dw = np.mean([float(v["RUNTIME_DW"]) for v in validations])
+            runtime_al = np.mean([float(v["RUNTIME_AL"]) for v in runtimes])
+            runtime_up = np.mean([float(v["RUNTIME_UP"]) for v in runtimes])
+            runtime_dw = np.mean([float(v["RUNTIME_DW"]) for v in runtimes])
             self.ckp.save_runtimes(runtime_al,runtime_up,runtime_dw)
+        self.ckp.save_benchmark(self.benchmark.report(
+            valid_iter=self.valid_iter, precision=self.args.precision))
+        self.benchmark.clear()
         # Perturbation/Noise testing i.e. perturb random SLR image in dataset
         # in different degrees and measure drop of PSNR.
         if save and self.args.valid_only:
@@ -157,6 +221,29 @@ class _Trainer_(object):
         self.valid_iter += 1
         torch.set_grad_enabled(True)
 
+    def validate_datasets(self, save: bool=False, finetuning: bool=False,
+                          runtime: bool=True) -> List[dict]:
+        """ Validate the model on all validation datasets, filling the
+        current row of the psnr log, and return the validation dictionaries.
+        All scales of a dataset are validated in one pass over its
+        multi-scale loader. """
+        validations = []
+        for dm, dis in self.loader_valid_multi:
+            vs = []
+            for di in dis:
+                d = self.loader_valid[di]
+                name, scale = d.dataset.name, d.dataset.scale
+                if save: self.ckp.begin_results(d, self.valid_iter)
+                vs.append({"dataset":"{}".format(name + " "*(10-len(name))),
+                           "scale": "x{}".format(scale)})
+            self.ckp.write_log(" ".join(["{}x{}".format(dm.dataset.name, s)
+                                         for s in dm.dataset.scales]))
+            vs = self.testing_core(vs, dm, dis, save=save,
+                                   finetuning=finetuning, runtime=runtime)
+            for di in dis: self.log_cache_stats(self.loader_valid[di])
+            validations.extend(vs)
+        return validations
+
     # =========================================================================
     # Trainer-Specific Functions
     # =========================================================================
@@ -164,87 +251,214 @@ class _Trainer_(object):
                           finetuning: bool, scale: int) -> optimization._Loss_:
         raise NotImplementedError
 
-    def testing_core(self, v: dict, dataset, di: int,
-                     save: bool=False, finetuning: bool=False) -> dict:
+    def testing_core(self, vs: List[dict], dm, dis: List[int],
+                     save: bool=False, finetuning: bool=False,
+                     runtime: bool=True) -> List[dict]:
+        """ Validate all scales of a dataset in one pass over its multi-scale
+        loader dm, which returns a sample for each of the validation loaders
+        dis, so that every image is loaded once for all scales. In reduced
+        precision every sample is also tested in float32 to report the
+        PSNR delta (PSNR_DELTA_x = PSNR - PSNR in float32). """
+        views = [self.loader_valid[di] for di in dis]
+        metrics = [tar_metrics._Metrics_(d.dataset.sample_size) for d in views]
+        metrics_fp32 = [tar_metrics._Metrics_(d.dataset.sample_size) for d in views]
+        for samples in dm:
+            with self.autocast():
+                pairs = self.testing_multi(samples, views, save=save,
+                                           finetuning=finetuning)
+            for k in range(len(views)): self.measure(metrics[k], pairs[k])
+            if self.precision is not None:
+                pairs = self.testing_multi(samples, views, finetuning=finetuning)
+                for k in range(len(views)):
+                    self.measure(metrics_fp32[k], pairs[k], psnr_only=True)
+            # Snapshot also while validating, since a validation pass might
+            # take longer than the grace period before the job is killed (the
+            # rest of the validation is skipped when resuming).
+            if not self.args.valid_only and self.snapshot_due(): self.snapshot()
+        for k, d in enumerate(views):
+            # Logging PSNR values.
+            stats = metrics[k].summary()
+            vs[k] = self.logging_core(stats, di=dis[k], v=vs[k])
+            if self.precision is not None:
+                stats_fp32 = metrics_fp32[k].summary()
+                for desc in self.psnr_description():
+                    name = "PSNR_{}".format(desc)
+                    delta = stats[name]["mean"] - stats_fp32[name]["mean"]
+                    vs[k]["PSNR_DELTA_{}".format(desc)] = "{:.3f}".format(delta)
+                    self.ckp.write_log("{}\t[{} x{}]\tPSNR delta ({}): {:.3f}".format(
+                        desc, d.dataset.name, d.dataset.scale,
+                        self.args.precision, delta))
+            # Determine runtimes for up and downscaling and overall.
+            if runtime:
+                with self.autocast(): vs[k] = self.runtime_core(d, vs[k])
+        return vs
+
+    def measure(self, metrics, pairs, psnr_only: bool=False):
+        """ Add metrics of the (output, target) batch pairs returned by
+        testing_sample (in order of psnr_description) on the device. """
+        nrange = [self.args.norm_min, self.args.norm_max]
+        for desc, (x, y) in zip(self.psnr_description(), pairs):
+            metrics.update("PSNR_{}".format(desc),
+                           tar_metrics.psnr(x, y, nrange[1] - nrange[0]))
+            if psnr_only: continue
+            metrics.update("PSNR_Y_{}".format(desc),
+                           tar_metrics.psnr_y(x, y, nrange))
+            metrics.update("SSIM_{}".format(desc),
+                           tar_metrics.ssim(x, y, nrange))
+
+    def testing_multi(self, samples, views, save: bool=False,
+                      finetuning: bool=False) -> List[List[Tuple[torch.Tensor]]]:
+        """ Test model on the samples of an image at all scales (views) of a
+        multi-scale loader and return the pairs of every view. Trainers may
+        override it to share computation across the scales. """
+        return [self.testing_sample(x, d, save=save, finetuning=finetuning)
+                for x, d in zip(samples, views)]
+
+    def testing_sample(self, data, d, save: bool=False,
+                       finetuning: bool=False) -> List[Tuple[torch.Tensor]]:
+        """ Test model on sample and return the (output, target) pairs in
+        order of psnr_description. """
         raise NotImplementedError
 
     def apply(self, lr, hr, scale, discretize=False, mode="all"):
         assert misc.is_power2(scale)
         assert mode in ["all", "up", "down"]
+        # In case of upscaling only decode the given LR image, otherwise
+        # encode the HR image (and decode the encoding).
+        if mode == "up": return self._upsample(lr, scale)
+        return self.apply_multi({scale: lr}, hr, discretize, mode)[scale]
+
+    def apply_multi(self, lrs: Dict[int, torch.Tensor], hr: torch.Tensor,
+                    discretize: bool=False, mode: str="all") -> dict:
+        """ Downscale the HR image to all scales of lrs (scale -> LR image)
+        by running the encoder chain once up to the largest scale. Every
+        intermediate encoding at a scale of lrs is added to its LR image
+        (guidance) and discretized, while the chain continues with the raw
+        encoding, so that the outputs equal those of apply() at every scale.
+        Return dictionary of scale -> lr_out (mode "down") or (lr_out, hr_out).
+        """
+        assert mode in ["all", "down"]
         nmin, nmax  = self.args.norm_min, self.args.norm_max
         iter_scale  = self.args.iter_scale_factor
-        assert scale % iter_scale == 0
-        # Downsample image until output (decoded image) has the
-        # the right scale, add to LR image and discretize.
-        def _downsample(hr, scale):
-            hr_in = hr.clone()
-            scl   = 1
-            while scl < scale:
-                lr_out = self.model.model.encode(hr_in)
-                hr_in, scl = lr_out, scl*iter_scale
-            if scale in self.args.scales_guidance and not self.args.no_guidance:
-                lr_out=torch.add(lr_out, lr.clone())
+        lr_outs, hr_in, scl = {}, hr, 1
+        while scl < max(lrs.keys()):
+            hr_in, scl = self.model.model.encode(hr_in), scl*iter_scale
+            if not scl in lrs: continue
+            lr_out = hr_in
+            if scl in self.args.scales_guidance and not self.args.no_guidance:
+                lr_out = torch.add(lr_out, lrs[scl])
             if discretize: lr_out = misc.discretize(lr_out,[nmin,nmax])
-            return lr_out
-        def _upsample(lr, scl):
-            hr_out = lr.clone()
-            while scl > 1:
-                hr_out = self.model.model.decode(hr_out)
-                scl    = scl//iter_scale
-            return hr_out
-        # In case of down- or upscaling only perform only part scalings.
-        if mode == "down": return _downsample(hr, scale)
-        elif mode == "up": return _upsample(lr, scale)
-        # Otherwise perform down- and upscaling and return both tensors.
-        lr_out = _downsample(hr, scale)
-        hr_out = _upsample(lr_out, scale)
-        return lr_out, hr_out
-
-    def logging_core(self, psnrs, di:int, v: dict) -> dict:
-        for ip, desc in enumerate(self.psnr_description()):
-            psnrs_i = psnrs[:,ip]
-            psnrs_i.sort()
-            v["PSNR_{}_best".format(desc)]="{:.3f}".format(psnrs_i[-1])
-            v["PSNR_{}_mean".format(desc)]="{:.3f}".format(np.mean(psnrs_i))
+            lr_outs[scl] = lr_out
+        assert lr_outs.keys() == lrs.keys(), \
+            "scales have to be powers of iter_scale_factor {}".format(iter_scale)
+        if mode == "down": return lr_outs
+        return {s: (x, self._upsample(x, s)) for s, x in lr_outs.items()}
+
+    def _upsample(self, lr, scale):
+        hr_out, scl = lr, scale
+        while scl > 1:
+            hr_out = self.model.model.decode(hr_out)
+            scl    = scl//self.args.iter_scale_factor
+        return hr_out
+
+    def logging_core(self, stats: dict, di:int, v: dict) -> dict:
+        """ Add summarized metrics (see metrics._Metrics_) to validation
+        dictionary and log PSNR values of the log description. """
+        for desc in self.psnr_description():
+            psnrs = stats["PSNR_{}".format(desc)]
+            for key in ["best", "mean"] + ["p{}".format(p) for p in
+                                           tar_metrics._Metrics_.percentiles]:
+                v["PSNR_{}_{}".format(desc, key)]="{:.3f}".format(psnrs[key])
+            v["PSNR_Y_{}_mean".format(desc)]="{:.3f}".format(
+                stats["PSNR_Y_{}".format(desc)]["mean"])
+            v["SSIM_{}_mean".format(desc)]="{:.4f}".format(
+                stats["SSIM_{}".format(desc)]["mean"])
         log = [float(v["PSNR_{}".format(x)]) for x in self.log_description()]
         self.ckp.log[-1, di, :] += torch.Tensor(log)
         return v
 
     def perturbation_core(self, d, eps: List[float]):
-        num_testing_samples = min(len(d), 10)
-        psnrs_t = np.zeros((num_testing_samples,len(eps)))
+        """ Perturb the SLR image of the first samples of the dataset with
+        cumulative gaussian noise of the given standard deviations and return
+        the mean PSNR of the decoded images for every eps. All perturbations of
+        an image are decoded as one batch (in chunks of perturbation_batch). """
+        num_testing_samples = min(len(d), self.args.perturbation_samples)
+        psnrs_t = torch.zeros((num_testing_samples,len(eps)), device=self.device)
         nmin, nmax  = self.args.norm_min, self.args.norm_max
         for id, (lr, hr, fname) in enumerate(d):
             if id >= num_testing_samples: break
             lr, hr = self.prepare([lr, hr])
             scale  = d.dataset.scale
             lr_out = self.apply(lr, hr, scale, discretize=True, mode="down")
-            for ie, e in enumerate(eps):
-                error = torch.normal(mean=0.0,std=torch.ones(lr_out.size())*e)
-                lr_out = lr_out.clone() + error.to(self.device)
-                hr_out_eps = self.apply(lr_out, hr, scale, mode="up")
-                hr_out_eps = misc.discretize(hr_out_eps, [nmin, nmax])
-                psnrs_t[id,ie] = misc.calc_psnr(hr_out_eps, hr, None, nmax-nmin)
-                if id == 0:
-                    slist, dlist = [hr_out_eps], ["SHRT_EPS_{:.2f}".format(e)]
-                    self.ckp.save_results(slist, dlist,fname[0],d,scale)
-        return psnrs_t.mean(axis=0)
+            lr_eps = self.perturb(lr_out, eps)
+            hr_out_eps = torch.cat([self.apply(x, hr, scale, mode="up")
+                for x in lr_eps.split(self.args.perturbation_batch)])
+            hr_out_eps = misc.discretize(hr_out_eps, [nmin, nmax])
+            psnrs_t[id,:] = tar_metrics.psnr(hr_out_eps, hr, nmax-nmin)
+            if id == 0:
+                slist = list(hr_out_eps.split(1))
+                dlist = ["SHRT_EPS_{:.2f}".format(e) for e in eps]
+                self.ckp.save_results(slist, dlist,fname[0],d,scale)
+        return psnrs_t.mean(dim=0).cpu().numpy()
+
+    @staticmethod
+    def perturb(x: torch.Tensor, eps: List[float]) -> torch.Tensor:
+        """ Return batch of perturbed copies of x (1,c,h,w), the k-th copy
+        perturbed by the sum of gaussian noise with std eps[0], ..., eps[k],
+        generated on the device of x. """
+        std = torch.tensor(eps, dtype=x.dtype, device=x.device).view(-1,1,1,1)
+        noise = torch.randn((len(eps),) + tuple(x.shape[1:]),
+                            dtype=x.dtype, device=x.device)
+        return x + torch.cumsum(noise*std, dim=0)
 
     def runtime_core(self, d, v: dict) -> dict:
-        runtimes = np.zeros((2, min(len(d),10)))
+        """ Benchmark encoding (downscaling) and decoding (upscaling) latency
+        of the first images of the dataset. When only validating, all
+        benchmark configurations (number of threads, batch size) are swept
+        and added to the benchmark report (benchmark.json), during training
+        merely the first image is timed once with the current configuration.
+        The median, 90th and 99th percentile latency [s] and throughput (HR
+        megapixels/s) of the first configuration are added to the validation
+        dictionary. """
+        sweep = self.args.valid_only
+        num_samples = self.args.bench_samples if sweep else 1
+        samples = []
         for i, (lr, hr, fname) in enumerate(d):
-            if i >= runtimes.shape[1]: break
-            lr, hr = self.prepare([lr, hr])
-            scale  = d.dataset.scale
-            timer_all = misc._Timer_()
-            self.apply(lr, hr, scale, discretize=False, mode="all")
-            runtimes[0,i] = timer_all.toc()
-            timer_up = misc._Timer_()
-            self.apply(lr, hr, scale, discretize=False, mode="up")
-            runtimes[1,i] = timer_up.toc()
-        v["RUNTIME_AL"] = "{:.8f}".format(np.median(runtimes[0,:]))
-        v["RUNTIME_UP"] = "{:.8f}".format(np.median(runtimes[1,:]))
-        v["RUNTIME_DW"] = str(max(float(v["RUNTIME_AL"])-float(v["RUNTIME_UP"]), 0.0))
+            if i >= num_samples: break
+            samples.append(self.prepare([lr, hr]))
+        scale = d.dataset.scale
+        if sweep:
+            configs, runs = self.benchmark.configs(), {}
+        else:
+            configs = [(torch.get_num_threads(), 1)]
+            runs = {"warmup": 0, "repeats": 1}
+        for threads, batch_size in configs:
+            times_dw, times_up, pixels = [], [], 0
+            for lr, hr in samples:
+                lr = lr.expand(batch_size, *lr.shape[1:]).contiguous()
+                hr = hr.expand(batch_size, *hr.shape[1:]).contiguous()
+                lr_out = self.apply(lr, hr, scale, mode="down")
+                times_dw += self.benchmark.time(
+                    lambda: self.apply(lr, hr, scale, mode="down"), **runs)
+                times_up += self.benchmark.time(
+                    lambda: self.apply(lr_out, hr, scale, mode="up"), **runs)
+                pixels += hr.numel()//hr.shape[1]
+            pixels = pixels//len(samples)
+            stats = {"DW": self.benchmark.summary(times_dw, pixels),
+                     "UP": self.benchmark.summary(times_up, pixels)}
+            if sweep:
+                self.benchmark.add({"dataset": d.dataset.name, "scale": scale,
+                                    "threads": threads, "batch_size": batch_size,
+                                    "down": stats["DW"], "up": stats["UP"]})
+            if "RUNTIME_AL" in v: continue
+            for key in ["DW", "UP"]:
+                for p in self.benchmark.percentiles:
+                    v["RUNTIME_{}_P{}".format(key, p)] = "{:.8f}".format(
+                        stats[key]["p{}".format(p)])
+                v["MPS_{}".format(key)] = "{:.3f}".format(stats[key]["mps"])
+            v["RUNTIME_DW"] = "{:.8f}".format(stats["DW"]["p50"])
+            v["RUNTIME_UP"] = "{:.8f}".format(stats["UP"]["p50"])
+            v["RUNTIME_AL"] = "{:.8f}".format(stats["DW"]["p50"]+stats["UP"]["p50"])
         return v
 
     def psnr_description(self) -> List[str]:
@@ -299,8 +513,49 @@ class _Trainer_(object):
             for d in datasets: _check(d.dataset, self.args.format)
         return True
 
-    def prepare(self, data):
-        return [a.to(self.device) for a in data[0:2]]
+    def autocast(self):
+        """ Return autocast context of the chosen precision (no-op context
+        for float32). """
+        if self.precision is None: return contextlib.ExitStack()
+        return torch.autocast(self.device.type, dtype=self.precision)
+
+    def log_cache_stats(self, d):
+        stats = d.dataset.cache_stats()
+        if stats is not None: self.ckp.write_log(stats)
+
+    def prepare(self, data, augment: bool=False):
+        return self.preprocess([a.to(self.device) for a in data[0:2]], augment)
+
+    def preprocess(self, tensors: List[torch.Tensor], augment: bool=False):
+        """ Batch-wise preprocessing of uint8 batches on the device, i.e.
+        normalization from rgb range to [norm_min, norm_max] and (if augment)
+        random flips and transpositions. Batches that have been preprocessed
+        in the loader workers already (float tensors) are returned as is. """
+        if not all([x.dtype == torch.uint8 for x in tensors]): return tensors
+        nmin, nmax = self.args.norm_min, self.args.norm_max
+        tensors = [misc.normalize(x.float(), nmin, nmax) for x in tensors]
+        if augment: tensors = misc.augment(tensors)
+        return tensors
+
+    def request_snapshot(self, signum, frame):
+        self.snapshot_signal = signum
+
+    def snapshot_due(self) -> bool:
+        minutes = self.args.snapshot_every
+        if self.snapshot_signal is not None: return True
+        return minutes > 0 and self.timer_snapshot.toc() > minutes*60
+
+    def snapshot(self, cursor: dict=None):
+        """ Save training state snapshot (see _Checkpoint_.save_snapshot).
+        If the snapshot was requested by SIGTERM or SIGUSR2 (sent by SGE
+        before killing the job), exit with code 99 afterwards, which makes
+        SGE reschedule the job. """
+        self.ckp.save_snapshot(self, cursor)
+        self.timer_snapshot.tic()
+        signum, self.snapshot_signal = self.snapshot_signal, None
+        self.ckp.write_log("Saved snapshot (signal={})".format(signum),
+                           refresh=True)
+        if signum in [signal.SIGTERM, signal.SIGUSR2]: sys.exit(99)
 
     def step(self):
         num_descs = len(self.log_description())
@@ -308,7 +563,10 @@ class _Trainer_(object):
             self.ckp.step(nlogs=num_descs)
             self.validation()
             return False
+        elif self.resume is not None:
+            return True
         else:
+            if self.snapshot_signal is not None: self.snapshot()
             epoch = self.optimizer.get_last_epoch() + 1
             if epoch > 1: self.ckp.save(self, epoch)
             return epoch < self.num_epochs() and self.ckp.step(nlogs=num_descs)
@@ -0,0 +1,12 @@
+from tar.trainers import icolor, iscale, vexternal
+
+def build_trainer(args, loader, model, loss, ckp):
+    """ Build trainer of the program type and data format. """
+    if args.type == "SCALING" and args.format == "IMAGE":
+        return iscale._Trainer_IScale_(args,loader,model,loss,ckp)
+    elif args.type == "COLORING" and args.format == "IMAGE":
+        return icolor._Trainer_IColor_(args,loader,model,loss,ckp)
+    elif args.type == "SCALING" and args.format == "VIDEO":
+        return vexternal._Trainer_VExternal_(args,loader,model,loss,ckp)
+    else:
+        raise ValueError("Invalid trainer selection {}".format(args.type))
@@ -5,7 +5,6 @@
 # Description : Task aware colorization trainer for images.
 # =============================================================================
 import argparse
-import numpy as np
 import random
 
 import torch
@@ -52,36 +51,31 @@ class _Trainer_IColor_(_Trainer_):
         loss = self.loss(loss_kwargs)
         return loss
 
-    def testing_core(self, v, d, di, save=False, finetuning=False):
-        num_valid_samples = d.dataset.sample_size
+    def testing_sample(self, data, d, save=False, finetuning=False):
+        gry, col, fname = data
         nmin, nmax  = self.args.norm_min, self.args.norm_max
-        psnrs = np.zeros((num_valid_samples, 2))
-        for i, (gry, col, fname) in enumerate(d):
-            gry, col = self.prepare([gry, col])
-            scale  = d.dataset.scale
-            if not self.args.no_task_aware:
-                gry_out, col_out_t = self.apply(gry, col, discretize=finetuning)
-            else:
-                gry_out, col_out_t = gry.clone(), self.apply(gry, col, mode="up")
-            # PSNR - Grey image.
-            gry_out = misc.discretize(gry_out, [nmin, nmax])
-            psnrs[i,0] = misc.calc_psnr(gry_out, gry, None, nmax-nmin)
-            # PSNR - Colored image (base: gry_out).
-            col_out_t = misc.discretize(col_out_t, [nmin, nmax])
-            psnrs[i,1] = misc.calc_psnr(col_out_t, col, None, nmax-nmin)
-            if save:
-                slist = [col_out_t, gry_out, gry, col]
-                dlist = ["SCOLT", "SGRY", "GRY", "COL"]
-                self.ckp.save_results(slist,dlist,fname[0],d,scale)
-            if save and i % self.args.n_threads == 0:
-                self.ckp.end_background()
-                self.ckp.begin_background()
-            #misc.progress_bar(i+1, num_valid_samples)
-        # Logging PSNR values.
-        v = self.logging_core(psnrs=psnrs, di=di, v=v)
-        # Determine runtimes for up and downscaling and overall.
-        v = self.runtime_core(d, v)
-        return v
+        gry, col = self.prepare([gry, col])
+        scale  = d.dataset.scale
+        if not self.args.no_task_aware:
+            gry_out, col_out_t = self.apply(gry, col, discretize=finetuning)
+        else:
+            gry_out, col_out_t = gry.clone(), self.apply(gry, col, mode="up")
+        # Discretized grey and colored image (base: gry_out).
+        gry_out = misc.discretize(gry_out, [nmin, nmax])
+        col_out_t = misc.discretize(col_out_t, [nmin, nmax])
+        if save:
+            slist = [col_out_t, gry_out, gry, col]
+            dlist = ["SCOLT", "SGRY", "GRY", "COL"]
+            self.ckp.save_results(slist,dlist,fname[0],d,scale)
+        return [(gry_out, gry), (col_out_t, col)]
+
+    def prepare(self, data, augment=False):
+        col = self.preprocess([data[1].to(self.device)], augment)[0]
+        # Grey input is built on the device if the loader merely returns
+        # the color images (empty grey tensor).
+        if data[0].numel() == 0:
+            return misc.entcolorize(col, self.args.color_space), col
+        return data[0].to(self.device), col
 
     def psnr_description(self):
         return ["SGRY","SCOLT"]
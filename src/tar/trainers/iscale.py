@@ -5,7 +5,6 @@
 # Description : Task aware super resolution trainer for images.
 # =============================================================================
 import argparse
-import numpy as np
 import random
 
 import torch
@@ -33,36 +32,47 @@ class _Trainer_IScale_(_Trainer_):
         loss = self.loss(loss_kwargs)
         return loss
 
-    def testing_core(self, v, d, di, save=False, finetuning=False):
-        num_valid_samples = d.dataset.sample_size
+    def testing_sample(self, data, d, save=False, finetuning=False):
+        lr, hr, fname = data
         nmin, nmax  = self.args.norm_min, self.args.norm_max
-        psnrs = np.zeros((num_valid_samples, 2))
-        for i, (lr, hr, fname) in enumerate(d):
-            lr, hr = self.prepare([lr, hr])
-            scale  = d.dataset.scale
-            if not self.args.no_task_aware:
-                lr_out, hr_out_t = self.apply(lr,hr,scale,discretize=finetuning)
-            else:
-                lr_out, hr_out_t = lr.clone(), self.apply(lr,hr,scale,mode="up")
-            # PSNR - Low resolution image.
-            lr_out = misc.discretize(lr_out, [nmin, nmax])
-            psnrs[i,0] = misc.calc_psnr(lr_out, lr, None, nmax-nmin)
-            # PSNR - High resolution image (base: lr_out).
-            hr_out_t = misc.discretize(hr_out_t, [nmin, nmax])
-            psnrs[i,1] = misc.calc_psnr(hr_out_t, hr, None, nmax-nmin)
+        lr, hr = self.prepare([lr, hr])
+        scale  = d.dataset.scale
+        if not self.args.no_task_aware:
+            lr_out, hr_out_t = self.apply(lr,hr,scale,discretize=finetuning)
+        else:
+            lr_out, hr_out_t = lr.clone(), self.apply(lr,hr,scale,mode="up")
+        # Discretized low resolution and high resolution (base: lr_out) image.
+        lr_out = misc.discretize(lr_out, [nmin, nmax])
+        hr_out_t = misc.discretize(hr_out_t, [nmin, nmax])
+        if save:
+            slist = [hr_out_t, lr_out, lr, hr]
+            dlist = ["SHRT", "SLR", "LR", "HR"]
+            self.ckp.save_results(slist,dlist,fname[0],d,scale)
+        return [(lr_out, lr), (hr_out_t, hr)]
+
+    def testing_multi(self, samples, views, save=False, finetuning=False):
+        """ Encode the HR image once for all validation scales (apply_multi),
+        if the HR images of all scales agree (i.e. no scale dependent crop). """
+        hrs = [x[1] for x in samples]
+        if self.args.no_task_aware or len(views) == 1 \
+        or any([x.shape != hrs[0].shape for x in hrs]):
+            return super(_Trainer_IScale_, self).testing_multi(
+                samples, views, save=save, finetuning=finetuning)
+        nmin, nmax = self.args.norm_min, self.args.norm_max
+        lrs = self.preprocess([x[0].to(self.device) for x in samples])
+        hr  = self.preprocess([hrs[0].to(self.device)])[0]
+        scales = [d.dataset.scale for d in views]
+        outs = self.apply_multi(dict(zip(scales, lrs)), hr, discretize=finetuning)
+        pairs = []
+        for (_, _, fname), d, lr, scale in zip(samples, views, lrs, scales):
+            # Discretized low resolution and high resolution (base: lr_out) image.
+            lr_out, hr_out_t = [misc.discretize(x, [nmin, nmax]) for x in outs[scale]]
             if save:
                 slist = [hr_out_t, lr_out, lr, hr]
                 dlist = ["SHRT", "SLR", "LR", "HR"]
                 self.ckp.save_results(slist,dlist,fname[0],d,scale)
-            if save and i % self.args.n_threads == 0:
-                self.ckp.end_background()
-                self.ckp.begin_background()
-            #misc.progress_bar(i+1, num_valid_samples)
-        # Logging PSNR values.
-        v = self.logging_core(psnrs=psnrs, di=di, v=v)
-        # Determine runtimes for up and downscaling and overall.
-        v = self.runtime_core(d, v)
-        return v
+            pairs.append([(lr_out, lr), (hr_out_t, hr)])
+        return pairs
 
     def psnr_description(self):
         return ["SLR","SHRT"]
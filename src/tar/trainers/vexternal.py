@@ -5,12 +5,12 @@
 # Description : Task aware super resolution trainer for videos.
 # =============================================================================
 import argparse
-import numpy as np
 import random
 
 import torch
 
 from tar.trainer import _Trainer_
+import tar.metrics as tar_metrics
 import tar.miscellaneous as misc
 
 class _Trainer_VExternal_(_Trainer_):
@@ -68,60 +68,59 @@ class _Trainer_VExternal_(_Trainer_):
         loss = self.loss(loss_kwargs)
         return loss
 
-    def testing_core(self, v, d, di, save=False, finetuning=False):
-        num_valid_samples = d.dataset.sample_size
+    def testing_sample(self, data, d, save=False, finetuning=False):
+        lrs, hrs, fnames = data
+        fnames   = [str(x)[2:-3] for x in fnames]
         nmin, nmax  = self.args.norm_min, self.args.norm_max
-        psnrs = np.zeros((num_valid_samples, 3))
-        for i, (lrs, hrs, fnames) in enumerate(d):
-            fnames   = [str(x)[2:-3] for x in fnames]
-            lrs, hrs = self.prepare([lrs, hrs])
-            lr0,lr1,lr2 = lrs; hr0,hr1,hr2 = hrs
-            scale  = d.dataset.scale
-            if not self.args.no_task_aware:
-                lr_out,hrm_out = self.apply(lrs,hrs,scale,discretize=finetuning)
-            else:
-                lr_out  = lrs[1].clone()
-                hrm_out = self.apply(lrs, hrs, scale, dec_input=lrs, mode="up")
-            # PSNR - Low resolution image.
-            lr_out = misc.discretize(lr_out, [nmin, nmax])
-            psnrs[i,0] = misc.calc_psnr(lr_out, lr1, None, nmax-nmin)
-            # PSNR - Model image.
-            psnrs[i,1] = misc.calc_psnr(hrm_out, hr1, None, nmax-nmin)
-            if save:
-                slist = [lr_out, hrm_out, lr1, hr1]
-                dlist = ["SLR", "SHRET", "LR", "HR"]
-                self.ckp.save_results(slist,dlist,fnames[1],d,scale)
-            if save and i % self.args.n_threads == 0:
-                self.ckp.end_background()
-                self.ckp.begin_background()
-            #misc.progress_bar(i+1, num_valid_samples)
-        # Logging PSNR values.
-        v = self.logging_core(psnrs=psnrs, di=di, v=v)
+        lrs, hrs = self.prepare([lrs, hrs])
+        lr0,lr1,lr2 = lrs; hr0,hr1,hr2 = hrs
+        scale  = d.dataset.scale
+        if not self.args.no_task_aware:
+            lr_out,hrm_out = self.apply(lrs,hrs,scale,discretize=finetuning)
+        else:
+            lr_out  = lrs[1].clone()
+            hrm_out = self.apply(lrs, hrs, scale, dec_input=lrs, mode="up")
+        # Discretized low resolution image.
+        lr_out = misc.discretize(lr_out, [nmin, nmax])
+        if save:
+            slist = [lr_out, hrm_out, lr1, hr1]
+            dlist = ["SLR", "SHRET", "LR", "HR"]
+            self.ckp.save_results(slist,dlist,fnames[1],d,scale)
+        return [(lr_out, lr1), (hrm_out, hr1)]
+
+    def runtime_core(self, d, v):
+        # Runtimes are not determined for the external video models.
         return v
 
     def perturbation_core(self, d, eps):
-        num_testing_samples = min(len(d), 10)
-        psnrs_t = np.zeros((num_testing_samples,len(eps)))
+        num_testing_samples = min(len(d), self.args.perturbation_samples)
+        psnrs_t = torch.zeros((num_testing_samples,len(eps)), device=self.device)
         nmin, nmax  = self.args.norm_min, self.args.norm_max
         for id, (lrs, hrs, fname) in enumerate(d):
             if id >= num_testing_samples: break
             lrs, hrs = self.prepare([lrs, hrs])
             lr0,lr1,lr2 = lrs; hr0,hr1,hr2 = hrs
             scale  = d.dataset.scale
-            lr_out = self.apply(lrs,hrs,scale,discretize=True,mode="down")
-            for ie, e in enumerate(eps):
-                error = torch.normal(mean=0.0,std=torch.ones(lr_out.size())*e)
-                lr_out = lr_out.clone() + error.to(self.device)
-                hr_out_eps = self.apply(lrs, hrs, scale,
-                                        dec_input=[None,lr_out,None], mode="up")
-                hr_out_eps = misc.discretize(hr_out_eps, [nmin, nmax])
-                psnrs_t[id,ie] = misc.calc_psnr(hr_out_eps, hr1, None, nmax-nmin)
-        return psnrs_t.mean(axis=0)
+            # Only the center frame is perturbed, the (unperturbed) encodings
+            # of the neighbouring frames are shared by all perturbations.
+            lr_outs = [super(_Trainer_VExternal_, self).apply(
+                       lr, hr, scale, discretize=True, mode="down")
+                       for lr, hr in zip(lrs, hrs)]
+            lr_eps = self.perturb(lr_outs[1], eps)
+            hr_out_eps = []
+            for x in lr_eps.split(self.args.perturbation_batch):
+                dec_input = [lr_outs[0].expand_as(x), x, lr_outs[2].expand_as(x)]
+                hr_out_eps.append(self.apply(lrs, hrs, scale,
+                                             dec_input=dec_input, mode="up"))
+            hr_out_eps = misc.discretize(torch.cat(hr_out_eps), [nmin, nmax])
+            psnrs_t[id,:] = tar_metrics.psnr(hr_out_eps, hr1, nmax-nmin)
+        return psnrs_t.mean(dim=0).cpu().numpy()
 
-    def prepare(self, data):
+    def prepare(self, data, augment=False):
         lrs = [a.to(self.device) for a in data[0]]
         hrs = [a.to(self.device) for a in data[1]]
-        return tuple(lrs), tuple(hrs)
+        frames = self.preprocess(lrs + hrs, augment)
+        return tuple(frames[:len(lrs)]), tuple(frames[len(lrs):])
 
     def psnr_description(self):
         return ["SLR","SHRET"]
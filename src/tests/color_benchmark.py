@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : Simon Schaefer
+# Description : Benchmark the batched color conversions (tar.color) against
+#               the former per-channel implementations (sofvsr, skimage).
+# Arguments   : Batch size (default 16), image size (default 256),
+#               number of trials (default 10).
+# =============================================================================
+import numpy as np
+import skimage.color as sc
+import sys
+import time
+import torch
+
+import tar.color as color
+
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+image_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+num_trials = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+devices    = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+# Former implementations (sofvsr/apply.py and tar/dataloader.py).
+def rgb2ycbcr_channels(x):
+    y  = 0.257*x[:, 0, :, :]+0.504*x[:, 1, :, :]+0.098*x[:, 2, :, :]+16/255.0
+    cb = -0.148*x[:, 0, :, :]-0.291*x[:, 1, :, :]+0.439*x[:, 2, :, :]+128/255.0
+    cr = 0.439*x[:, 0, :, :]-0.368*x[:, 1, :, :]-0.071*x[:, 2, :, :]+128/255.0
+    return torch.stack((y, cb, cr), 1)
+
+def ycbcr2rgb_channels(x):
+    r = 1.164*(x[:, 0, :, :]-16/255.0)+1.596*(x[:, 2, :, :]-128/255.0)
+    g = 1.164*(x[:, 0, :, :]-16/255.0)-0.392*(x[:, 1, :, :]-128/255.0)
+    g = g-0.813*(x[:, 2, :, :]-128/255.0)
+    b = 1.164*(x[:, 0, :, :]-16/255.0)+2.017*(x[:, 1, :, :]-128/255.0)
+    return torch.stack((r, g, b), 1)
+
+def skimage_per_sample(fn, x):
+    imgs = x.cpu().numpy().transpose((0, 2, 3, 1))
+    return np.stack([fn(img) for img in imgs])
+
+def measure(fn, x, device):
+    fn(x)
+    times = []
+    for _ in range(num_trials):
+        if device == "cuda": torch.cuda.synchronize()
+        start_time = time.time()
+        fn(x)
+        if device == "cuda": torch.cuda.synchronize()
+        times.append(time.time() - start_time)
+    return np.median(times)
+
+print("Benchmarking color conversions (batch {}x3x{}x{}) ...".format(
+      batch_size, image_size, image_size))
+for device in devices:
+    x = torch.rand(batch_size, 3, image_size, image_size, device=device)
+    x8 = (x*255).byte()
+    out = torch.empty_like(x)
+    cases = [
+        ("rgb2ycbcr", lambda x: rgb2ycbcr_channels(x),
+                      lambda x: color.rgb2ycbcr(x, out=out)),
+        ("ycbcr2rgb", lambda x: ycbcr2rgb_channels(x),
+                      lambda x: color.ycbcr2rgb(x, out=out)),
+        ("rgb2ycbcr (uint8)", lambda x: rgb2ycbcr_channels(x.float()/255.0),
+                              lambda x: color.rgb2ycbcr(x8, out=out))
+    ]
+    if device == "cpu":
+        cases += [
+            ("rgb2gray", lambda x: skimage_per_sample(sc.rgb2gray, x),
+                         lambda x: color.rgb2gray(x)),
+            ("rgb2hue", lambda x: skimage_per_sample(sc.rgb2hsv, x),
+                        lambda x: color.rgb2hue(x)),
+            ("rgb2lab", lambda x: skimage_per_sample(sc.rgb2lab, x),
+                        lambda x: color.rgb2lab(x, out=out))
+        ]
+    for name, former, batched in cases:
+        t_former = measure(former, x, device)
+        t_batched = measure(batched, x, device)
+        print("... {} {:<18}: former {:.2f}ms, batched {:.2f}ms ({:.1f}x)".format(
+              device, name, t_former*1000, t_batched*1000, t_former/t_batched))
+
+# Check conversions against skimage.
+print("Checking conversions against skimage ...")
+img = np.random.rand(64, 64, 3)
+x = color.from_numpy(img)
+checks = [
+    ("rgb2ycbcr", sc.rgb2ycbcr(img)/255.0, color.rgb2ycbcr(x)),
+    ("rgb2gray", sc.rgb2gray(img)[:, :, np.newaxis], color.rgb2gray(x)),
+    ("rgb2hue", sc.rgb2hsv(img)[:, :, 0:1], color.rgb2hue(x)),
+    ("rgb2lab", sc.rgb2lab(img), color.rgb2lab(x)),
+    ("lab2rgb", img, color.lab2rgb(color.rgb2lab(x)))
+]
+for name, expected, result in checks:
+    error = np.abs(color.to_numpy(result) - expected).max()
+    print("... {:<10}: max abs error {:.2e}".format(name, error))
@@ -7,13 +7,18 @@
 import imageio
 import numpy as np
 import os
+import tempfile
+import time
 import unittest
 
 import torch
 from torch import nn
 
+import tar.archive as archive
+import tar.color as color
 import tar.inputs as argus
 import tar.dataloader as dataloader
+import tar.metrics as metrics
 import tar.optimization as optimization
 import tar.miscellaneous as miscellaneous
 import tar.modules as modules
@@ -32,29 +37,129 @@ class DataLoaderTest(unittest.TestCase):
 
     def test_batching(self):
         args = argus.args
-        args.patch_size, args.scales_train = 96, [2,4]
+        args.patch_size = 96
         loader = dataloader._Data_(args)
-        for scale, d in loader.loader_train.items():
-            for batch, (lr, hr, files) in enumerate(d):
+        for scale in [2, 4]:
+            for d in loader.loader_train[scale]:
+                lr, hr, files = next(iter(d))
+                assert lr.dtype == torch.uint8 and hr.dtype == torch.uint8
                 assert lr.shape[0] == args.batch_size and hr.shape[0] == args.batch_size
                 assert lr.shape[1] == args.n_colors and hr.shape[1] == args.n_colors
                 s, ls = args.patch_size, int(args.patch_size/scale)
                 assert lr.shape[2] == ls and hr.shape[2] == s
                 assert lr.shape[3] == ls and hr.shape[3] == s
-                break
+        loader.shutdown()
 
     def test_div2k(self):
         args = argus.args
         args.data_train = ["DIV2K"]
-        args.patch_size, args.scale = 96, 2
+        args.patch_size, scale = 96, 2
         loader = dataloader._Data_(args)
-        for batch, (lr, hr, files) in enumerate(loader.loader_train[2]):
+        for d in loader.loader_train[scale]:
+            lr, hr, files = next(iter(d))
             assert lr.shape[0] == args.batch_size and hr.shape[0] == args.batch_size
             assert lr.shape[1] == args.n_colors and hr.shape[1] == args.n_colors
-            s, ls = args.patch_size, int(args.patch_size/args.scale)
+            s, ls = args.patch_size, int(args.patch_size/scale)
             assert lr.shape[2] == ls and hr.shape[2] == s
             assert lr.shape[3] == ls and hr.shape[3] == s
-            break
+        loader.shutdown()
+
+class DataStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "HR")
+        os.makedirs(self.directory)
+        self.images = {"a.png": np.random.randint(0,256,(12,16,3),np.uint8),
+                       "b.png": np.random.randint(0,256,(32,40,3),np.uint8),
+                       "c.png": np.random.randint(0,256,(6,6),np.uint8)}
+        for name, img in self.images.items():
+            imageio.imwrite(os.path.join(self.directory, name), img)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_manifest(self):
+        manifest = dataloader._Manifest_(self.directory)
+        assert len(manifest) == 3 and os.path.isfile(manifest.path)
+        assert manifest.paths()[0] == os.path.join(self.directory, "a.png")
+        assert manifest.shape("b.png") == (32, 40, 3)
+        assert manifest.shape("c.png") == (6, 6, 1)
+        # Reloaded from file, rebuilding changed entries only.
+        imageio.imwrite(os.path.join(self.directory, "d.png"),
+                        np.zeros((4,5,3), np.uint8))
+        reloaded = dataloader._Manifest_(self.directory)
+        assert len(reloaded) == 4 and reloaded.shape("d.png") == (4, 5, 3)
+        assert reloaded.entries["a.png"] == manifest.entries["a.png"]
+
+    def test_pack_roundtrip(self):
+        assert dataloader._PackedDataset_.open(self.directory) is None
+        assert dataloader._PackedDataset_.pack(self.directory) == 3
+        packed = dataloader._PackedDataset_.open(self.directory)
+        assert len(packed) == 3 and "a.png" in packed
+        for name, img in self.images.items():
+            img = dataloader._Dataset_._expand_dimension(img)
+            assert packed[name].shape == img.shape
+            assert np.array_equal(packed[name], img)
+
+    def test_shared_cache_eviction(self):
+        nbytes = self.images["b.png"].nbytes
+        cache = dataloader._SharedCache_(os.path.join(self.tmp.name, "cache"),
+                                         budget=int(2.5*nbytes))
+        paths = [os.path.join(self.directory, x) for x in ["a.png", "b.png"]]
+        loader = lambda _: self.images["b.png"]
+        def load(path, tag=""):
+            img = cache.load(path, loader, tag=tag)
+            time.sleep(0.01) # distinct modification times
+            return img
+        for path in paths: load(path)
+        load(paths[0])         # hit, a is more recently used than b
+        load(paths[0], "x2")   # miss, evicts b
+        assert cache.counter.hits.value == 1
+        assert cache.counter.misses.value == 3
+        assert np.array_equal(load(paths[0]), self.images["b.png"])
+        assert cache.counter.hits.value == 2
+        load(paths[1])
+        assert cache.counter.misses.value == 4
+        assert len(os.listdir(cache.directory)) == 2
+
+class SamplerTest(unittest.TestCase):
+
+    def test_weighted_mix_sampler(self):
+        sampler = dataloader._WeightedMixSampler_([3, 10], [3.0, 1.0], 8)
+        indices = list(sampler)
+        assert len(indices) == len(sampler) == 8
+        first = [x for x in indices if x < 3]
+        assert len(first) == 6
+        assert all([first.count(x) == 2 for x in range(3)])
+        assert all([3 <= x < 13 for x in indices if not x in first])
+
+    def test_contiguous_batch_sampler(self):
+        sampler = dataloader._ContiguousBatchSampler_(10, 2, num_workers=2)
+        batches = list(sampler)
+        assert batches == [[0,1], [6,7], [2,3], [8,9], [4,5]]
+        assert batches[0::2] == [[0,1], [2,3], [4,5]]
+
+    def test_pool_loader_resume(self):
+        dataset = list(range(20))
+        for num_workers in [0, 2]:
+            pool = dataloader._WorkerPool_([dataset], num_workers)
+            sampler = torch.utils.data.BatchSampler(
+                torch.utils.data.RandomSampler(dataset), 3, drop_last=False)
+            loader = dataloader._PoolLoader_(pool, 0, sampler)
+            batches = []
+            for i, data in enumerate(loader):
+                if i == 2: break
+                batches.append(data.tolist())
+            state = loader.state_dict(position=2)
+            resumed = dataloader._PoolLoader_(pool, 0, sampler)
+            resumed.load_state_dict(state)
+            batches.extend([data.tolist() for data in resumed])
+            assert batches == state["batches"]
+            assert sorted(sum(batches, [])) == dataset
+            # Next iteration draws new batches from the sampler.
+            assert len(list(resumed)) == len(sampler)
+            pool.shutdown()
 
 class MiscellaneousTest(unittest.TestCase):
 
@@ -70,6 +175,38 @@ class MiscellaneousTest(unittest.TestCase):
         ckp.write_log("test")
         ckp.done()
 
+    def test_augment(self):
+        x = torch.arange(4*2*5*5).view(4,2,5,5).float()
+        lr, hr = miscellaneous.augment([x, x.clone()])
+        assert torch.equal(lr, hr)
+        for i in range(4):
+            assert torch.equal(lr[i].view(-1).sort()[0], x[i].view(-1))
+
+    def test_downscale(self):
+        # Compare to the offline LR generation (src/datasets/downsample.py).
+        import skimage.transform
+        presults = os.environ["SR_PROJECT_PROJECT_HOME"] + "/src/tests/"
+        hr = imageio.imread(presults+"/ressources/HR.png")[:128,:192,:3]
+        for scale in [2, 4, 8]:
+            lr = skimage.transform.rescale(hr, 1.0/scale, anti_aliasing=True,
+                multichannel=True, mode='reflect', preserve_range=True, order=4)
+            x = torch.from_numpy(hr).permute(2,0,1).unsqueeze(0).float()
+            x = miscellaneous.downscale(x, scale)[0].permute(1,2,0).numpy()
+            assert x.shape == lr.shape
+            assert np.abs(x - lr).max() < 1.0
+
+class ColorTest(unittest.TestCase):
+
+    def test_conversions(self):
+        import skimage.color
+        img = np.random.randint(0, 256, (8,8,3), np.uint8)
+        x = color.from_numpy(img)
+        y = skimage.color.rgb2ycbcr(img)[:,:,0]
+        assert np.abs(color.rgb2y(x)[0,0].numpy()*255 - y).max() < 1e-2
+        x = x.float()/255.0
+        assert torch.allclose(color.ycbcr2rgb(color.rgb2ycbcr(x)), x, atol=1e-5)
+        assert torch.allclose(color.lab2rgb(color.rgb2lab(x)), x, atol=1e-3)
+
 class OptimizationTest(unittest.TestCase):
 
     def test_loss_init(self):
@@ -93,11 +230,11 @@ class OptimizationTest(unittest.TestCase):
         # Test forward.
         loss = optimization._Loss_(args, ckp)
         loss.start_log()
-        for batch, (lr, hr, files) in enumerate(loader_train[2]):
-            loss_kwargs = {'HR_GT': hr, 'HR_OUT': hr}
-            loss_sum = loss.forward(loss_kwargs)
-            assert loss_sum == 0
-            break
+        lr, hr, files = next(iter(loader_train[2][0]))
+        loss_kwargs = {'HR_GT': hr.float(), 'HR_OUT': hr.float()}
+        loss_sum = loss.forward(loss_kwargs)
+        assert loss_sum == 0
+        loader.shutdown()
         ckp.done()
 
     def test_loss_display(self):
@@ -158,6 +295,31 @@ class PSNRTest(unittest.TestCase):
         psnr = miscellaneous.calc_psnr(shr, hr, patch_size=None, rgb_range=1.0)
         assert np.abs(psnr - 38.7728) < 1e-4
 
+    def test_psnr_batched(self):
+        presults = os.environ["SR_PROJECT_PROJECT_HOME"] + "/src/tests/"
+        shr = imageio.imread(presults+"/ressources/SHR.png")
+        shr = torch.from_numpy(shr).permute(2,0,1).unsqueeze(0).float()/255.0
+        hr  = imageio.imread(presults+"/ressources/HR.png")
+        hr  = torch.from_numpy(hr).permute(2,0,1).unsqueeze(0).float()/255.0
+        psnrs = metrics.psnr(torch.cat([shr, hr]), torch.cat([hr, hr]), 1.0)
+        assert np.abs(psnrs[0].item() - 38.7728) < 1e-3
+        assert psnrs[1].item() == 100.0
+        ssims = metrics.ssim(torch.cat([shr, hr]), torch.cat([hr, hr]), [0.0, 1.0])
+        assert ssims[0].item() < 1.0 and np.abs(ssims[1].item() - 1.0) < 1e-5
+        # Negative PSNR (mse > range^2) as misc.calc_psnr.
+        x, y = torch.full((1,3,4,4), 3.0), torch.zeros((1,3,4,4))
+        psnr = miscellaneous.calc_psnr(x, y, rgb_range=1.0)
+        assert psnr < 0 and np.abs(metrics.psnr(x, y, 1.0).item() - psnr) < 1e-4
+
+class ArchiveTest(unittest.TestCase):
+
+    def test_delta_roundtrip(self):
+        key = torch.randn(64, 3, 3, 3)
+        x = key + 1e-4*torch.randn(64, 3, 3, 3)
+        data = archive.encode(x, key, level=6)
+        assert len(data) < x.numel()*x.element_size()
+        assert torch.equal(archive.decode(data, key), x)
+
 
 if __name__ == '__main__':
     unittest.main()